@@ -1,22 +1,172 @@
 #!/usr/bin/env python3
+import os
+import sys
+import time
 import sqlite3
+import threading
+
+# sqlite_utils has a single home, next to the decorator exercises
+# (python-decorators-0x01); put that directory on the import path
+_SHARED = os.path.normpath(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir,
+    "python-decorators-0x01"))
+if _SHARED not in sys.path:
+    sys.path.append(_SHARED)
+
+from sqlite_utils import connect, connect_readonly, get_writer
+
+
+class MemorySnapshot:
+    """A copy of a database file served from shared-cache memory.
+
+    refresh() copies the file with the backup API into a fresh in-memory
+    database and then switches new connections over to it, so readers of
+    the old copy are never blocked by a refresh. With max_age set, a copy
+    older than that many seconds is refreshed on the next connect().
+    Snapshot connections are query_only: writes belong on the file.
+    """
+
+    def __init__(self, db_name, max_age=None):
+        self.db_name = db_name
+        self.max_age = max_age
+        self.uri = None
+        self.loaded_at = None
+        self.refreshes = 0
+        self._anchor = None
+        # _lock guards the published copy and is held only briefly;
+        # _refresh_lock serialises the (slow) backups
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def refresh(self):
+        """Reload the snapshot from db_name now."""
+        self._reload()
+
+    def _reload(self, seen=None):
+        # seen is the refreshes count a caller found expired: if another
+        # thread has reloaded since, its copy is used instead of a new one
+        with self._refresh_lock:
+            if seen is not None and self.refreshes != seen:
+                return
+            # A distinct name per copy; the anchor connection keeps it alive
+            uri = (f"file:snapshot_{id(self)}_{self.refreshes + 1}"
+                   "?mode=memory&cache=shared")
+            anchor = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            source = sqlite3.connect(self.db_name)
+            try:
+                source.backup(anchor)
+            except Exception:
+                anchor.close()
+                raise
+            finally:
+                source.close()
+            with self._lock:
+                old, self._anchor = self._anchor, anchor
+                self.uri = uri
+                self.loaded_at = time.monotonic()
+                self.refreshes += 1
+                if old is not None:
+                    # connect() opens under _lock, so nobody is still about
+                    # to open the old copy; open readers keep it until they
+                    # close
+                    old.close()
+
+    def _expired(self):
+        return self.uri is None or (
+            self.max_age is not None
+            and time.monotonic() - self.loaded_at > self.max_age
+        )
+
+    def connect(self):
+        """Open a read-only connection to the current copy."""
+        with self._lock:
+            expired = self._expired()
+            seen = self.refreshes
+        if expired:
+            self._reload(seen)
+        with self._lock:
+            conn = sqlite3.connect(self.uri, uri=True)
+        conn.execute("PRAGMA query_only=ON")
+        return conn
+
+
+# One snapshot per database path, shared by every DatabaseConnection
+snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def get_snapshot(db_name, max_age=None):
+    """Return the MemorySnapshot for db_name, creating it on first use."""
+    key = os.path.abspath(db_name)
+    with _snapshots_lock:
+        if key not in snapshots:
+            snapshots[key] = MemorySnapshot(db_name, max_age)
+        return snapshots[key]
+
+
+def refresh_snapshot(db_name):
+    """Reload the in-memory snapshot of db_name on demand."""
+    get_snapshot(db_name).refresh()
 
 
 class DatabaseConnection:
-    """Custom class-based context manager for handling SQLite database connections."""
+    """Custom class-based context manager for handling SQLite database connections.
+
+    route selects the connection:
+        None    -- a private read-write connection (closed on exit)
+        "read"  -- a read-only (mode=ro) connection; with a WAL profile
+                   (e.g. "balanced") it never blocks writers
+        "write" -- the process-wide serialised writer for db_name; the block
+                   is committed on success and rolled back on error. A
+                   write block nested in another (same thread) shares its
+                   transaction: only the outermost one commits
+        "snapshot" -- a read-only connection to an in-memory copy of db_name
+                   (see MemorySnapshot), reloaded once older than
+                   snapshot_max_age seconds or by refresh_snapshot()
+    """
+
+    ROUTES = (None, "read", "write", "snapshot")
 
-    def __init__(self, db_name):
+    def __init__(self, db_name, profile=None, route=None,
+                 snapshot_max_age=None):
+        if route not in self.ROUTES:
+            raise ValueError(f"Unknown route: {route!r}")
         self.db_name = db_name
+        self.profile = profile
+        self.route = route
+        self.snapshot_max_age = snapshot_max_age
         self.conn = None
+        self.writer = None
+        self.nested = False
 
     def __enter__(self):
         """Establish the database connection and return the connection object."""
-        self.conn = sqlite3.connect(self.db_name)
+        if self.route == "write":
+            self.writer = get_writer(self.db_name, self.profile)
+            self.nested = self.writer.held()
+            self.conn = self.writer.acquire()
+        elif self.route == "snapshot":
+            self.conn = get_snapshot(self.db_name, self.snapshot_max_age).connect()
+        elif self.route == "read":
+            # As in ConnectionRouter: only the writer can apply the
+            # profile's journal_mode (WAL), so make sure it has done so
+            get_writer(self.db_name, self.profile).open()
+            self.conn = connect_readonly(self.db_name, self.profile)
+        else:
+            self.conn = connect(self.db_name, self.profile)
         return self.conn
 
     def __exit__(self, exc_type, exc_value, traceback):
         """Ensure the connection is closed, even if an exception occurs."""
-        if self.conn:
+        if self.writer:
+            # The writer is shared: hand it back instead of closing it
+            try:
+                if exc_type is None and not self.nested:
+                    self.conn.commit()
+            finally:
+                self.writer.release(self.conn)
+                self.writer = None
+        elif self.conn:
             self.conn.close()
         # Returning False means exceptions (if any) are propagated
         return False
@@ -1,33 +1,162 @@
 #!/usr/bin/env python3
-import sqlite3
+import os
+import sys
+import time
+from itertools import islice
+
+# sqlite_utils has a single home, next to the decorator exercises
+# (python-decorators-0x01); put that directory on the import path
+_SHARED = os.path.normpath(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir,
+    "python-decorators-0x01"))
+if _SHARED not in sys.path:
+    sys.path.append(_SHARED)
+
+from sqlite_utils import is_read_only, statement_timeout
+
+DatabaseConnection = __import__("0-databaseconnection").DatabaseConnection
 
 
 class ExecuteQuery:
-    """Context manager that executes a given SQL query with parameters."""
+    """Context manager that executes a given SQL query with parameters.
+
+    With query_timeout (seconds) set, a query still running past it is
+    interrupted and QueryTimeout is raised from __enter__.
+
+    route is passed to DatabaseConnection; "auto" sends read-only queries
+    to a read-only connection and anything else to the serialised writer.
 
-    def __init__(self, db_name, query, params=None):
+    With stream=True, __enter__ returns an iterator over the rows instead
+    of a list; they are fetched chunk_size at a time and the cursor stays
+    open until __exit__, so memory use does not grow with the result. The
+    query_timeout then covers the whole with block.
+    """
+
+    def __init__(self, db_name, query, params=None, profile=None,
+                 query_timeout=None, route=None, stream=False,
+                 chunk_size=1000):
+        if route == "auto":
+            route = "read" if is_read_only(query) else "write"
         self.db_name = db_name
         self.query = query
         self.params = params if params else ()
+        self.profile = profile
+        self.query_timeout = query_timeout
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.db = DatabaseConnection(db_name, profile, route)
+        self.timeout = None
         self.conn = None
         self.cursor = None
         self.results = None
 
     def __enter__(self):
         """Establish connection, execute query, and return the results."""
-        self.conn = sqlite3.connect(self.db_name)
-        self.cursor = self.conn.cursor()
-        self.cursor.execute(self.query, self.params)
-        self.results = self.cursor.fetchall()
+        self.conn = self.db.__enter__()
+        try:
+            self.timeout = statement_timeout(self.conn, self.query_timeout)
+            self.timeout.__enter__()
+            self.cursor = self.conn.cursor()
+            self.cursor.execute(self.query, self.params)
+            if self.stream:
+                return self._iter_rows()
+            self.results = self.cursor.fetchall()
+        except Exception:
+            # __exit__ is not called when __enter__ raises
+            self.__exit__(*sys.exc_info())
+            raise
+        self._end_timeout(None, None, None)
         return self.results
 
+    def _iter_rows(self):
+        fetchmany = self.cursor.fetchmany
+        while True:
+            rows = fetchmany(self.chunk_size)
+            if not rows:
+                return
+            yield from rows
+
+    def _end_timeout(self, exc_type, exc_value, traceback):
+        # May raise QueryTimeout in place of an interrupted statement
+        timeout, self.timeout = self.timeout, None
+        if timeout is not None:
+            timeout.__exit__(exc_type, exc_value, traceback)
+
     def __exit__(self, exc_type, exc_value, traceback):
         """Close cursor and connection."""
+        try:
+            self._end_timeout(exc_type, exc_value, traceback)
+        finally:
+            self._close(exc_type, exc_value, traceback)
+        return False
+
+    def _close(self, exc_type, exc_value, traceback):
         if self.cursor:
             self.cursor.close()
         if self.conn:
-            self.conn.close()
-        return False
+            self.db.__exit__(exc_type, exc_value, traceback)
+
+
+class BulkExecuteQuery(ExecuteQuery):
+    """ExecuteQuery running one statement over many parameter tuples.
+
+    rows may be any iterable (a generator keeps memory flat); it is read
+    chunk_size tuples at a time and passed to executemany(), all in one
+    transaction committed before __enter__ returns, or rolled back if any
+    chunk fails. When the connection is already inside a transaction
+    (e.g. the writer held further up the stack) committing is left to
+    its owner. __enter__ returns a report with rows, chunks, seconds and
+    rows_per_sec.
+    """
+
+    def __init__(self, db_name, query, rows, profile=None, chunk_size=1000,
+                 route=None, query_timeout=None):
+        super().__init__(db_name, query, profile=profile,
+                         query_timeout=query_timeout, route=route,
+                         chunk_size=chunk_size)
+        self.rows = rows
+        self.report = None
+
+    def __enter__(self):
+        """Run the statement for every row and return the throughput report."""
+        self.conn = self.db.__enter__()
+        start = time.perf_counter()
+        count = chunks = 0
+        began = False
+        try:
+            self.timeout = statement_timeout(self.conn, self.query_timeout)
+            self.timeout.__enter__()
+            self.cursor = self.conn.cursor()
+            began = not self.conn.in_transaction
+            if began:
+                self.cursor.execute("BEGIN")
+            rows = iter(self.rows)
+            while True:
+                chunk = list(islice(rows, self.chunk_size))
+                if not chunk:
+                    break
+                self.cursor.executemany(self.query, chunk)
+                count += len(chunk)
+                chunks += 1
+            if began:
+                self.conn.commit()
+        except Exception:
+            if began and self.conn.in_transaction:
+                self.conn.rollback()
+            # __exit__ is not called when __enter__ raises
+            self.__exit__(*sys.exc_info())
+            raise
+        self._end_timeout(None, None, None)
+        seconds = time.perf_counter() - start
+        self.report = {
+            "rows": count,
+            "chunks": chunks,
+            "seconds": round(seconds, 6),
+            "rows_per_sec": round(count / seconds) if seconds else count,
+        }
+        print(f"[BULK] {count} rows in {seconds:.3f}s "
+              f"({self.report['rows_per_sec']} rows/s)")
+        return self.report
 
 
 if __name__ == "__main__":
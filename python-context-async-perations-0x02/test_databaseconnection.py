@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+_databaseconnection = __import__("0-databaseconnection")
+
+from sqlite_utils import get_writer  # noqa: E402
+DatabaseConnection = _databaseconnection.DatabaseConnection
+MemorySnapshot = _databaseconnection.MemorySnapshot
+refresh_snapshot = _databaseconnection.refresh_snapshot
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.workdir.name, "users.db")
+        conn = sqlite3.connect(self.path)
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT)")
+        conn.executemany("INSERT INTO users VALUES (?, ?)",
+                         [(i, f"user{i}") for i in range(1000)])
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def count(self, route="snapshot", **options):
+        with DatabaseConnection(self.path, route=route, **options) as conn:
+            return conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def insert(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("INSERT INTO users (name) VALUES ('new')")
+        conn.commit()
+        conn.close()
+
+    def test_snapshot_is_a_read_only_copy_until_refreshed(self):
+        self.assertEqual(self.count(), 1000)
+        self.insert()
+        self.assertEqual(self.count(), 1000)
+        self.assertEqual(self.count(route=None), 1001)
+        refresh_snapshot(self.path)
+        self.assertEqual(self.count(), 1001)
+
+        with DatabaseConnection(self.path, route="snapshot") as conn:
+            with self.assertRaises(sqlite3.OperationalError):
+                conn.execute("DELETE FROM users")
+
+    def test_old_copy_stays_readable_across_a_refresh(self):
+        snapshot = MemorySnapshot(self.path)
+        reader = snapshot.connect()
+        self.insert()
+        snapshot.refresh()
+        try:
+            self.assertEqual(reader.execute(
+                "SELECT COUNT(*) FROM users").fetchone()[0], 1000)
+        finally:
+            reader.close()
+        conn = snapshot.connect()
+        try:
+            self.assertEqual(conn.execute(
+                "SELECT COUNT(*) FROM users").fetchone()[0], 1001)
+        finally:
+            conn.close()
+
+    def test_expired_copy_is_reloaded_once_for_concurrent_readers(self):
+        snapshot = MemorySnapshot(self.path, max_age=0.05)
+        snapshot.connect().close()
+        time.sleep(0.1)
+        barrier = threading.Barrier(8)
+        errors = []
+
+        def reader():
+            barrier.wait()
+            try:
+                conn = snapshot.connect()
+                try:
+                    conn.execute("SELECT COUNT(*) FROM users").fetchone()
+                finally:
+                    conn.close()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=reader) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(snapshot.refreshes, 2)
+
+
+class WriteRouteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.workdir.name, "users.db")
+        conn = sqlite3.connect(self.path)
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT)")
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        get_writer(self.path).close()
+        self.workdir.cleanup()
+
+    def names(self):
+        with DatabaseConnection(self.path) as conn:
+            return [row[0] for row in conn.execute("SELECT name FROM users")]
+
+    def test_nested_write_block_does_not_commit_the_outer_one(self):
+        with self.assertRaises(ValueError):
+            with DatabaseConnection(self.path, route="write") as outer:
+                outer.execute("INSERT INTO users (name) VALUES ('outer')")
+                with DatabaseConnection(self.path, route="write") as inner:
+                    self.assertIs(inner, outer)
+                    inner.execute("INSERT INTO users (name) VALUES ('inner')")
+                raise ValueError("abort")
+        self.assertEqual(self.names(), [])
+
+        with DatabaseConnection(self.path, route="write") as outer:
+            with DatabaseConnection(self.path, route="write") as inner:
+                inner.execute("INSERT INTO users (name) VALUES ('inner')")
+        self.assertEqual(self.names(), ["inner"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+import io
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+# Importing 1-execute puts sqlite_utils' directory on the import path
+_execute = __import__("1-execute")
+
+from sqlite_utils import QueryTimeout, get_writer  # noqa: E402
+
+ExecuteQuery = _execute.ExecuteQuery
+BulkExecuteQuery = _execute.BulkExecuteQuery
+DatabaseConnection = _execute.DatabaseConnection
+
+
+class ExecuteTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.workdir.name, "users.db")
+        conn = sqlite3.connect(self.path)
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, age INTEGER)")
+        conn.executemany("INSERT INTO users VALUES (?, ?)",
+                         [(i, 20 + i % 20) for i in range(1, 2501)])
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+
+class StreamingTest(ExecuteTestCase):
+
+    def test_stream_yields_the_same_rows_as_fetchall(self):
+        query = "SELECT * FROM users WHERE age > ? ORDER BY id"
+        with ExecuteQuery(self.path, query, (25,)) as results:
+            expected = results
+        with ExecuteQuery(self.path, query, (25,), stream=True,
+                          chunk_size=100) as rows:
+            self.assertNotIsInstance(rows, list)
+            self.assertEqual(list(rows), expected)
+
+    def test_rows_are_fetched_chunk_size_at_a_time(self):
+        query = ExecuteQuery(self.path, "SELECT * FROM users", stream=True,
+                             chunk_size=1000)
+        with query as rows:
+            next(rows)
+            # One chunk fetched so far: the cursor still has the rest
+            self.assertEqual(len(query.cursor.fetchmany(5000)), 1500)
+
+    def test_leaving_early_closes_the_cursor(self):
+        query = ExecuteQuery(self.path, "SELECT * FROM users", stream=True)
+        with query as rows:
+            next(rows)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            query.cursor.fetchone()
+
+    def test_query_timeout_covers_the_fetch_loop(self):
+        slow = ("WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c"
+                " LIMIT 50000000) SELECT x FROM c")
+        with self.assertRaises(QueryTimeout):
+            with ExecuteQuery(self.path, slow, stream=True,
+                              query_timeout=0.05) as rows:
+                for _ in rows:
+                    pass
+
+
+class BulkTest(ExecuteTestCase):
+
+    INSERT = "INSERT INTO users VALUES (?, ?)"
+
+    def setUp(self):
+        super().setUp()
+        # Keep the throughput lines out of the test output
+        patcher = mock.patch("sys.stdout", io.StringIO())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        get_writer(self.path).close()
+        super().tearDown()
+
+    def count(self):
+        with ExecuteQuery(self.path, "SELECT COUNT(*) FROM users") as rows:
+            return rows[0][0]
+
+    def test_generator_rows_are_inserted_in_chunks(self):
+        rows = ((i, 30) for i in range(10001, 12501))
+        with BulkExecuteQuery(self.path, self.INSERT, rows,
+                              chunk_size=1000) as report:
+            self.assertEqual((report["rows"], report["chunks"]), (2500, 3))
+        self.assertEqual(self.count(), 5000)
+
+    def test_failing_chunk_rolls_back_every_chunk(self):
+        # The last row repeats an existing id
+        rows = [(i, 30) for i in range(10001, 10011)] + [(1, 30)]
+        with self.assertRaises(sqlite3.IntegrityError):
+            with BulkExecuteQuery(self.path, self.INSERT, rows, chunk_size=4):
+                pass
+        self.assertEqual(self.count(), 2500)
+
+    def test_commit_is_left_to_an_enclosing_transaction(self):
+        with self.assertRaises(ValueError):
+            with DatabaseConnection(self.path, route="write") as conn:
+                conn.execute("BEGIN")
+                with BulkExecuteQuery(self.path, self.INSERT,
+                                      [(10001, 30)], route="write"):
+                    pass
+                raise ValueError("abort the outer transaction")
+        self.assertEqual(self.count(), 2500)
+
+
+if __name__ == "__main__":
+    unittest.main()
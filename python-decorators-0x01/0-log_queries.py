@@ -1,32 +1,362 @@
 #!/usr/bin/env python3
-import sqlite3
+import sys
+import json
+import time
+import atexit
+import random
+import inspect
 import functools
-from datetime import datetime 
-
-# Decorator to log SQL queries with timestamp
-def log_queries(func):
-    @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        query = kwargs.get("query") if "query" in kwargs else (args[0] if args else None)
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        if query:
-            print(f"[{timestamp}] Executing SQL query: {query}")
-        else:
-            print(f"[{timestamp}] Executing SQL query: <No query provided>")
-        return func(*args, **kwargs)
-    return wrapper
+import threading
+from collections import deque
+from datetime import datetime
+
+from db_pool import default_pool
+from sql_utils import normalize_sql
+
+
+# Upper bounds (ms) of the latency histogram buckets; the last is open
+LATENCY_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500,
+                      1000, 2500, float("inf"))
+
+
+class _QueryStat:
+    __slots__ = ("count", "errors", "rows", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS_MS)
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given percentile."""
+        target = fraction * self.count
+        seen = 0
+        for bound, hits in zip(LATENCY_BUCKETS_MS, self.buckets):
+            seen += hits
+            if seen >= target:
+                return round(min(bound, self.max * 1000), 3)
+        return round(self.max * 1000, 3)
+
+
+class QueryStats:
+    """Per-normalised-query latency histograms, row counts and slow queries.
+
+    Fed by the QueryLogWriter thread, so nothing here runs on the caller's
+    path. Queries slower than slow_threshold seconds have their
+    EXPLAIN QUERY PLAN captured once per normalised query using pool.
+    """
+
+    def __init__(self, slow_threshold=0.1, pool=None, max_slow=100):
+        self.slow_threshold = slow_threshold
+        self.pool = pool or default_pool
+        self.slow = deque(maxlen=max_slow)
+        self._stats = {}
+        self._plans = {}
+        self._lock = threading.Lock()
+
+    def record(self, timestamp, query, params, duration, rows, error):
+        key = normalize_sql(query) if query else "<No query provided>"
+        with self._lock:
+            stat = self._stats.get(key)
+            if stat is None:
+                stat = self._stats[key] = _QueryStat()
+            stat.count += 1
+            stat.total += duration
+            stat.max = max(stat.max, duration)
+            stat.rows += rows
+            if error:
+                stat.errors += 1
+            ms = duration * 1000
+            for i, bound in enumerate(LATENCY_BUCKETS_MS):
+                if ms <= bound:
+                    stat.buckets[i] += 1
+                    break
+        if query and duration >= self.slow_threshold:
+            self.slow.append({
+                "ts": timestamp,
+                "query": key,
+                "duration_ms": round(ms, 3),
+                "rows": rows,
+                "plan": self._explain(key, query, params),
+            })
+
+    def _explain(self, key, query, params):
+        if key not in self._plans:
+            try:
+                with self.pool.connection() as conn:
+                    self._plans[key] = [
+                        row[-1] for row in conn.execute(
+                            "EXPLAIN QUERY PLAN " + query, params or ())
+                    ]
+            except Exception as e:
+                self._plans[key] = [f"<EXPLAIN failed: {e}>"]
+        return self._plans[key]
+
+    def snapshot(self):
+        """Return {normalised query: summary} sorted by total time spent."""
+        with self._lock:
+            items = sorted(self._stats.items(),
+                           key=lambda item: item[1].total, reverse=True)
+            return {
+                key: {
+                    "count": stat.count,
+                    "errors": stat.errors,
+                    "rows": stat.rows,
+                    "total_ms": round(stat.total * 1000, 3),
+                    "mean_ms": round(stat.total * 1000 / stat.count, 3),
+                    "max_ms": round(stat.max * 1000, 3),
+                    "p50_ms": stat.percentile(0.5),
+                    "p95_ms": stat.percentile(0.95),
+                    "p99_ms": stat.percentile(0.99),
+                    "histogram": dict(zip(
+                        (str(bound) for bound in LATENCY_BUCKETS_MS),
+                        stat.buckets)),
+                }
+                for key, stat in items
+            }
+
+    def slow_queries(self):
+        """Return the most recent slow-query captures, oldest first."""
+        return list(self.slow)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+        self.slow.clear()
+
+
+class QueryLogWriter:
+    """Background writer for structured query log records.
+
+    Callers only append a tuple to a bounded deque; a daemon thread wakes
+    every flush_interval, applies sampling and the rate limit, formats
+    timestamps and writes the batch as JSON lines to stream.
+
+    Every record also feeds stats (a QueryStats) before sampling, and with
+    dump_interval set a "query_stats" snapshot line is written that often.
+
+    sample_rate   -- fraction of records kept (0.0 - 1.0)
+    rate_limit    -- most records written per second (None for no limit)
+    max_pending   -- records buffered before the oldest are dropped
+    dump_interval -- seconds between stats snapshots (None to disable)
+    """
+
+    def __init__(self, stream=None, flush_interval=0.2, batch_size=512,
+                 sample_rate=1.0, rate_limit=None, max_pending=10000,
+                 stats=None, dump_interval=None):
+        self.stream = stream
+        self.stats_collector = stats or QueryStats()
+        self.dump_interval = dump_interval
+        self._dumped = time.monotonic()
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.sample_rate = sample_rate
+        self.rate_limit = rate_limit
+        self._pending = deque(maxlen=max_pending)
+        self._wake = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._tokens = rate_limit or 0
+        self._refilled = time.monotonic()
+        self.submitted = 0
+        self.written = 0
+        self.sampled_out = 0
+        self.rate_limited = 0
+
+    def submit(self, record):
+        """Queue a record tuple; never blocks on I/O."""
+        if self._thread is None:
+            self._start()
+        self._pending.append(record)
+        self.submitted += 1
+
+    def flush(self):
+        """Write everything queued so far from the calling thread."""
+        with self._write_lock:
+            while self._pending:
+                self._write_batch()
+
+    def close(self):
+        """Stop the writer thread and flush what is left."""
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def stats(self):
+        """Return a snapshot of the writer counters."""
+        return {
+            "submitted": self.submitted,
+            "written": self.written,
+            "sampled_out": self.sampled_out,
+            "rate_limited": self.rate_limited,
+            "pending": len(self._pending),
+        }
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="query-log-writer", daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        while not self._wake.is_set():
+            self._wake.wait(self.flush_interval)
+            self.flush()
+            if self.dump_interval is not None \
+                    and time.monotonic() - self._dumped >= self.dump_interval:
+                self._dumped = time.monotonic()
+                self.dump_stats()
+
+    def dump_stats(self):
+        """Write the current stats snapshot as one JSON line."""
+        line = json.dumps({
+            "ts": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "event": "query_stats",
+            "queries": self.stats_collector.snapshot(),
+            "slow": self.stats_collector.slow_queries(),
+        })
+        with self._write_lock:
+            stream = self.stream or sys.stdout
+            stream.write(line + "\n")
+            stream.flush()
+
+    def _allow(self, count):
+        """Token bucket: return how many of count records may be written."""
+        if self.rate_limit is None:
+            return count
+        now = time.monotonic()
+        self._tokens = min(
+            self.rate_limit,
+            self._tokens + (now - self._refilled) * self.rate_limit,
+        )
+        self._refilled = now
+        allowed = min(count, int(self._tokens))
+        self._tokens -= allowed
+        return allowed
+
+    def _write_batch(self):
+        batch = []
+        pending = self._pending
+        record_stats = self.stats_collector.record
+        while pending and len(batch) < self.batch_size:
+            record = pending.popleft()
+            record_stats(record[0], *record[2:])
+            if self.sample_rate >= 1.0 or random.random() < self.sample_rate:
+                batch.append(record)
+            else:
+                self.sampled_out += 1
+        allowed = self._allow(len(batch))
+        self.rate_limited += len(batch) - allowed
+        lines = [self._format(record) for record in batch[:allowed]]
+        if lines:
+            stream = self.stream or sys.stdout
+            stream.write("\n".join(lines) + "\n")
+            stream.flush()
+            self.written += len(lines)
+
+    @staticmethod
+    def _format(record):
+        timestamp, func_name, query, _, duration, rows, error = record
+        line = {
+            "ts": datetime.fromtimestamp(timestamp).strftime(
+                "%Y-%m-%d %H:%M:%S"),
+            "event": "sql_query",
+            "func": func_name,
+            "query": query if query else "<No query provided>",
+            "duration_ms": round(duration * 1000, 3),
+            "rows": rows,
+        }
+        if error:
+            line["error"] = error
+        return json.dumps(line)
+
+
+# Writer shared by the bare @log_queries form
+query_logger = QueryLogWriter()
+query_stats = query_logger.stats_collector
+
+
+def _row_count(result):
+    if isinstance(result, list):
+        return len(result)
+    return 0 if result is None else 1
+
+
+# Decorator to log and time SQL queries
+def log_queries(func=None, *, writer=None):
+    """Decorator to log and time SQL queries through a QueryLogWriter.
+
+    Latency, row count and any exception type are recorded per call;
+    see query_stats.snapshot() and query_stats.slow_queries(). Coroutine
+    functions are timed across their await.
+    """
+    def decorator(func):
+        name = func.__qualname__
+
+        def submit(args, kwargs, timestamp, start, result, error):
+            query = kwargs.get("query") if "query" in kwargs else (args[0] if args else None)
+            params = kwargs.get("params") if "params" in kwargs else (args[1] if len(args) > 1 else None)
+            (writer or query_logger).submit((
+                timestamp, name, query, params,
+                time.perf_counter() - start, _row_count(result), error,
+            ))
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                timestamp = time.time()
+                start = time.perf_counter()
+                result = None
+                error = None
+                try:
+                    result = await func(*args, **kwargs)
+                    return result
+                except Exception as e:
+                    error = type(e).__name__
+                    raise
+                finally:
+                    submit(args, kwargs, timestamp, start, result, error)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            timestamp = time.time()
+            start = time.perf_counter()
+            result = None
+            error = None
+            try:
+                result = func(*args, **kwargs)
+                return result
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                submit(args, kwargs, timestamp, start, result, error)
+        return wrapper
+
+    if func is not None:
+        return decorator(func)
+    return decorator
 
 
 @log_queries
 def fetch_all_users(query):
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    cursor.execute(query)
-    results = cursor.fetchall()
-    conn.close()
-    return results
+    with default_pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query)
+        return cursor.fetchall()
 
 
 if __name__ == "__main__":
     users = fetch_all_users(query="SELECT * FROM users")
+    query_logger.flush()
     print(users)
+    print(json.dumps(query_stats.snapshot(), indent=2))
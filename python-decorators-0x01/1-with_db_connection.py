@@ -1,18 +1,11 @@
 #!/usr/bin/env python3
-import sqlite3
-import functools
-
-def with_db_connection(func):
-    """Decorator to automatically handle opening and closing the database connection."""
-    @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        conn = sqlite3.connect('users.db')
-        try:
-            result = func(conn, *args, **kwargs)
-        finally:
-            conn.close()
-        return result
-    return wrapper
+import asyncio
+
+# Connections come from a per-thread pool shared with the other tasks
+from db_pool import default_async_pool, with_db_connection
+
+# sqlite's default limit on bound parameters in older builds
+MAX_BATCH = 999
 
 
 @with_db_connection
@@ -22,7 +15,160 @@ def get_user_by_id(conn, user_id):
     return cursor.fetchone()
 
 
+@with_db_connection
+def get_users_by_ids(conn, user_ids):
+    """Fetch many users with one WHERE id IN (...) query per chunk.
+
+    Returns a dict mapping each found id to its row.
+    """
+    cursor = conn.cursor()
+    found = {}
+    user_ids = list(user_ids)
+    for start in range(0, len(user_ids), MAX_BATCH):
+        chunk = user_ids[start:start + MAX_BATCH]
+        marks = ",".join("?" * len(chunk))
+        cursor.execute(f"SELECT * FROM users WHERE id IN ({marks})", chunk)
+        id_index = [col[0] for col in cursor.description].index("id")
+        for row in cursor.fetchall():
+            found[row[id_index]] = row
+    return found
+
+
+class _PendingUser:
+    """Handle returned by UserLoader.load(); get() triggers the batch."""
+    __slots__ = ("loader", "user_id")
+
+    def __init__(self, loader, user_id):
+        self.loader = loader
+        self.user_id = user_id
+
+    def get(self):
+        return self.loader._resolve(self.user_id)
+
+
+class UserLoader:
+    """Request-scoped batch loader for get_user_by_id lookups.
+
+    load() only records the id; the first get() on any handle fetches every
+    id recorded so far with one IN query. Results (including misses, as
+    None) are memoised for the loader's lifetime, so create one loader per
+    request.
+    """
+
+    def __init__(self):
+        self._rows = {}
+        self._queued = {}
+        self.queries = 0
+
+    def load(self, user_id):
+        """Queue user_id and return a handle whose get() yields the row."""
+        if user_id not in self._rows:
+            self._queued[user_id] = None
+        return _PendingUser(self, user_id)
+
+    def load_many(self, user_ids):
+        """Return the rows for user_ids, in order, via one batch."""
+        handles = [self.load(user_id) for user_id in user_ids]
+        return [handle.get() for handle in handles]
+
+    def dispatch(self):
+        """Fetch every queued id now."""
+        if not self._queued:
+            return
+        queued, self._queued = list(self._queued), {}
+        found = get_users_by_ids(queued)
+        self.queries += 1
+        for user_id in queued:
+            self._rows[user_id] = found.get(user_id)
+
+    def prime(self, user_id, row):
+        self._rows[user_id] = row
+
+    def clear(self):
+        self._rows.clear()
+
+    def _resolve(self, user_id):
+        if user_id not in self._rows:
+            self.dispatch()
+        return self._rows[user_id]
+
+
+class AsyncUserLoader:
+    """asyncio variant of UserLoader backed by aiosqlite.
+
+    Every load() awaited within the same event-loop tick is served by one
+    IN query, scheduled with loop.call_soon. Futures are memoised per id
+    for the loader's lifetime. Connections come from pool, by default the
+    shared default_async_pool.
+    """
+
+    def __init__(self, pool=None):
+        self.pool = pool if pool is not None else default_async_pool
+        self._futures = {}
+        self._queued = []
+        self._scheduled = False
+        # The loop only keeps weak references to tasks
+        self._tasks = set()
+        self.queries = 0
+
+    def load(self, user_id):
+        """Return an awaitable resolving to the row for user_id (or None)."""
+        future = self._futures.get(user_id)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._futures[user_id] = loop.create_future()
+            self._queued.append(user_id)
+            if not self._scheduled:
+                self._scheduled = True
+                loop.call_soon(self._start_dispatch)
+        return future
+
+    async def load_many(self, user_ids):
+        return await asyncio.gather(*(self.load(user_id) for user_id in user_ids))
+
+    def clear(self):
+        self._futures.clear()
+
+    def _start_dispatch(self):
+        self._scheduled = False
+        queued, self._queued = self._queued, []
+        task = asyncio.ensure_future(self._dispatch(queued))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, queued):
+        futures = [self._futures[user_id] for user_id in queued]
+        try:
+            async with self.pool.connection() as db:
+                found = {}
+                for start in range(0, len(queued), MAX_BATCH):
+                    chunk = queued[start:start + MAX_BATCH]
+                    marks = ",".join("?" * len(chunk))
+                    async with db.execute(
+                        f"SELECT * FROM users WHERE id IN ({marks})", chunk
+                    ) as cursor:
+                        id_index = [col[0] for col in cursor.description].index("id")
+                        for row in await cursor.fetchall():
+                            found[row[id_index]] = row
+            self.queries += 1
+        except Exception as e:
+            for user_id, future in zip(queued, futures):
+                # Failed lookups are not memoised, so a later load retries
+                self._futures.pop(user_id, None)
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for user_id, future in zip(queued, futures):
+            if not future.done():
+                future.set_result(found.get(user_id))
+
+
 if __name__ == "__main__":
     # Fetch user by ID with automatic connection handling
     user = get_user_by_id(user_id=1)
     print(user)
+
+    # Collapse N point lookups into a single query
+    loader = UserLoader()
+    users = loader.load_many(range(1, 11))
+    print(f"Loaded {len(users)} users with {loader.queries} query")
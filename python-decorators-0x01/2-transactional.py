@@ -1,36 +1,301 @@
 #!/usr/bin/env python3
-import sqlite3
+import time
+import queue
+import atexit
+import inspect
 import functools
+import threading
+from concurrent.futures import Future
 
+from cache_store import invalidate_tables
+from db_pool import with_db_connection
+from sql_utils import write_tables
+from sqlite_utils import connect
 
-# Connection-handling decorator from the previous task
-def with_db_connection(func):
-    """Decorator to automatically handle opening and closing the database connection."""
-    @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        conn = sqlite3.connect('users.db')
-        try:
-            result = func(conn, *args, **kwargs)
-        finally:
-            conn.close()
-        return result
-    return wrapper
+
+# Nesting depth of transactional calls per open connection
+_depths = {}
 
 
 # Transaction management decorator
 def transactional(func):
-    """Decorator to manage database transactions (commit or rollback)."""
+    """Decorator to manage database transactions (commit or rollback).
+
+    The outermost call owns the transaction. Nested calls on the same
+    connection run inside a SAVEPOINT: on success it is released, on
+    failure only the inner call's work is rolled back before the error
+    propagates, so the outer call can recover and carry on.
+
+    Tables written during the transaction are recorded through the
+    connection's trace callback; once the commit succeeds, cached query
+    results reading those tables are invalidated.
+
+    Coroutine functions get the same behaviour on an aiosqlite connection.
+    """
+    if inspect.iscoroutinefunction(func):
+        return _async_transactional(func)
+
     @functools.wraps(func)
     def wrapper(conn, *args, **kwargs):
+        return _run_transaction(conn, func, args, kwargs)
+    return wrapper
+
+
+def _run_transaction(conn, func, args, kwargs):
+    """Call func(conn, ...) as a transaction, or a savepoint when nested.
+
+    The body of the transactional wrapper, shared with db_stack.
+    """
+    depth = _depths.get(id(conn), 0)
+    if depth:
+        return _run_in_savepoint(conn, depth, func, args, kwargs)
+    written = set()
+
+    def trace(statement):
+        written.update(write_tables(statement))
+
+    conn.set_trace_callback(trace)
+    _depths[id(conn)] = 1
+    try:
+        if not conn.in_transaction:
+            # Explicit BEGIN so inner savepoints never end the transaction
+            conn.execute("BEGIN")
+        result = func(conn, *args, **kwargs)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"[ERROR] Transaction rolled back due to: {e}")
+        raise
+    finally:
+        del _depths[id(conn)]
+        conn.set_trace_callback(None)
+    invalidate_tables(written)
+    return result
+
+
+def _run_in_savepoint(conn, depth, func, args, kwargs):
+    name = f"transactional_{depth}"
+    conn.execute(f"SAVEPOINT {name}")
+    _depths[id(conn)] = depth + 1
+    try:
+        result = func(conn, *args, **kwargs)
+    except Exception as e:
+        conn.execute(f"ROLLBACK TO {name}")
+        conn.execute(f"RELEASE {name}")
+        print(f"[ERROR] Rolled back to savepoint {name} due to: {e}")
+        raise
+    else:
+        conn.execute(f"RELEASE {name}")
+        return result
+    finally:
+        _depths[id(conn)] = depth
+
+
+def _async_transactional(func):
+    @functools.wraps(func)
+    async def async_wrapper(conn, *args, **kwargs):
+        depth = _depths.get(id(conn), 0)
+        if depth:
+            return await _async_run_in_savepoint(
+                conn, depth, func, args, kwargs)
+        written = set()
+
+        def trace(statement):
+            written.update(write_tables(statement))
+
+        await conn.set_trace_callback(trace)
+        _depths[id(conn)] = 1
         try:
-            result = func(conn, *args, **kwargs)
-            conn.commit()
-            return result
+            if not conn.in_transaction:
+                await conn.execute("BEGIN")
+            result = await func(conn, *args, **kwargs)
+            await conn.commit()
         except Exception as e:
-            conn.rollback()
+            await conn.rollback()
             print(f"[ERROR] Transaction rolled back due to: {e}")
             raise
-    return wrapper
+        finally:
+            del _depths[id(conn)]
+            await conn.set_trace_callback(None)
+        invalidate_tables(written)
+        return result
+    return async_wrapper
+
+
+async def _async_run_in_savepoint(conn, depth, func, args, kwargs):
+    name = f"transactional_{depth}"
+    await conn.execute(f"SAVEPOINT {name}")
+    _depths[id(conn)] = depth + 1
+    try:
+        result = await func(conn, *args, **kwargs)
+    except Exception as e:
+        await conn.execute(f"ROLLBACK TO {name}")
+        await conn.execute(f"RELEASE {name}")
+        print(f"[ERROR] Rolled back to savepoint {name} due to: {e}")
+        raise
+    else:
+        await conn.execute(f"RELEASE {name}")
+        return result
+    finally:
+        _depths[id(conn)] = depth
+
+
+class GroupCommitter:
+    """Commit transactional work from many callers in shared transactions.
+
+    Callers hand work to a single writer thread, which runs up to max_batch
+    queued calls (waiting at most window seconds for more to arrive) inside
+    one transaction and commits them with a single fsync. Each call runs in
+    its own SAVEPOINT, so a failing call is rolled back and reported to its
+    caller alone. If the final commit fails, every call in the batch fails.
+    Work must not commit or roll back the connection itself.
+    """
+
+    def __init__(self, database="users.db", max_batch=64, window=0.002,
+                 profile=None):
+        self.database = database
+        self.max_batch = max_batch
+        self.window = window
+        self.profile = profile
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.batches = 0
+        self.committed = 0
+        self.failed = 0
+
+    def submit(self, func, *args, **kwargs):
+        """Queue func(conn, *args, **kwargs); return a Future for its result."""
+        future = Future()
+        # Queue before checking the thread: a writer that dies fails what is
+        # queued before it clears _thread, and work queued later restarts it
+        self._queue.put((future, func, args, kwargs))
+        if self._thread is None:
+            self._start()
+        return future
+
+    def stop(self):
+        """Finish queued work and stop the writer thread."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="group-commit", daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def _run(self):
+        batch = []
+        try:
+            conn = connect(self.database, self.profile)
+            try:
+                while True:
+                    item = self._queue.get()
+                    if item is None:
+                        return
+                    batch = [item]
+                    closing = False
+                    until = time.monotonic() + self.window
+                    while len(batch) < self.max_batch:
+                        remaining = until - time.monotonic()
+                        try:
+                            item = self._queue.get(timeout=max(remaining, 0))
+                        except queue.Empty:
+                            break
+                        if item is None:
+                            closing = True
+                            break
+                        batch.append(item)
+                    self._commit_batch(conn, batch)
+                    batch = []
+                    if closing:
+                        return
+            finally:
+                conn.close()
+        except BaseException as e:
+            # The writer cannot go on (no connection, or work raised a
+            # BaseException): fail everything waiting on it rather than
+            # leaving callers blocked on futures nobody will resolve
+            print(f"[ERROR] Group commit writer stopped due to: {e!r}")
+            self._fail(batch, e)
+            with self._start_lock:
+                self._thread = None
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not None:
+                        self._fail([item], e)
+
+    def _fail(self, batch, error):
+        for future, _, _, _ in batch:
+            if not future.done():
+                self.failed += 1
+                future.set_exception(error)
+
+    def _commit_batch(self, conn, batch):
+        written = set()
+        done = []
+        conn.set_trace_callback(
+            lambda statement: written.update(write_tables(statement)))
+        # Nested @transactional calls inside the work become savepoints
+        _depths[id(conn)] = 1
+        try:
+            conn.execute("BEGIN")
+            for future, func, args, kwargs in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    result = _run_in_savepoint(conn, 1, func, args, kwargs)
+                except Exception as e:
+                    self.failed += 1
+                    future.set_exception(e)
+                else:
+                    done.append((future, result))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"[ERROR] Group commit rolled back due to: {e}")
+            # Completed, running and not-yet-started calls all fail with it
+            self._fail(batch, e)
+            return
+        finally:
+            del _depths[id(conn)]
+            conn.set_trace_callback(None)
+        self.batches += 1
+        self.committed += len(done)
+        invalidate_tables(written)
+        for future, result in done:
+            future.set_result(result)
+
+
+# Writer shared by the bare @group_transactional form
+group_committer = GroupCommitter("users.db")
+
+
+def group_transactional(func=None, *, committer=None):
+    """Decorator running a transactional function through a GroupCommitter.
+
+    Replaces the @with_db_connection/@transactional pair: the call blocks
+    until its batch commits, then returns the result or raises the error.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            active = committer if committer is not None else group_committer
+            return active.submit(func, *args, **kwargs).result()
+        return wrapper
+
+    if func is not None:
+        return decorator(func)
+    return decorator
 
 
 @with_db_connection
@@ -40,6 +305,12 @@ def update_user_email(conn, user_id, new_email):
     cursor.execute("UPDATE users SET email = ? WHERE id = ?", (new_email, user_id))
 
 
+@group_transactional
+def update_user_email_grouped(conn, user_id, new_email):
+    cursor = conn.cursor()
+    cursor.execute("UPDATE users SET email = ? WHERE id = ?", (new_email, user_id))
+
+
 if __name__ == "__main__":
     # Update user's email with automatic transaction handling
     update_user_email(user_id=1, new_email='Crawford_Cartwright@hotmail.com')
@@ -1,42 +1,147 @@
 #!/usr/bin/env python3
 import time
+import random
+import asyncio
+import inspect
 import sqlite3
 import functools
+import threading
 
+# Reuse the pooled connection handler from the previous task
+from db_pool import with_db_connection
+from sqlite_utils import QueryTimeout
 
-# Reuse connection handler from previous task
-def with_db_connection(func):
-    """Decorator to automatically handle opening and closing the database connection."""
-    @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        conn = sqlite3.connect('users.db')
-        try:
-            result = func(conn, *args, **kwargs)
-        finally:
-            conn.close()
-        return result
-    return wrapper
+
+# sqlite errors that can succeed if simply tried again later
+TRANSIENT_MESSAGES = (
+    "database is locked",
+    "database table is locked",
+    "database schema has changed",
+)
+
+
+def is_transient(exc):
+    """Return True for errors worth retrying (lock contention and the like).
+
+    QueryTimeout is not transient: a query that ran out of time once will
+    likely do so again. Pass retry_if=lambda e: isinstance(e, QueryTimeout)
+    or is_transient(e) to retry it anyway.
+    """
+    if isinstance(exc, QueryTimeout):
+        return False
+    if isinstance(exc, sqlite3.OperationalError):
+        message = str(exc).lower()
+        return any(text in message for text in TRANSIENT_MESSAGES)
+    return False
+
+
+class RetryStats:
+    """Counters describing how much retrying a decorated function does."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.deadline_exceeded = 0
+        self.sleep_time = 0.0
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "failures": self.failures,
+                "deadline_exceeded": self.deadline_exceeded,
+                "sleep_time": round(self.sleep_time, 6),
+            }
+
+
+def _backoff(error, attempt, start, stats, retries, delay, max_delay,
+             deadline, retry_if):
+    """Return seconds to wait before the next attempt, or None to raise.
+
+    Shared by retry_on_failure and db_stack; attempt counts from 1.
+    """
+    if not retry_if(error):
+        stats.add(failures=1)
+        return None
+    print(f"[WARNING] Attempt {attempt} failed due to: {error}")
+    if attempt >= retries:
+        print("[ERROR] All retry attempts failed.")
+        stats.add(failures=1)
+        return None
+    # Full jitter keeps contending clients out of lockstep
+    pause = random.uniform(0, min(max_delay, delay * 2 ** (attempt - 1)))
+    if deadline is not None and time.monotonic() - start + pause > deadline:
+        print("[ERROR] Retry deadline exceeded.")
+        stats.add(failures=1, deadline_exceeded=1)
+        return None
+    print(f"Retrying in {pause:.2f} seconds...")
+    stats.add(retries=1, sleep_time=pause)
+    return pause
 
 
 # Retry decorator
-def retry_on_failure(retries=3, delay=2):
-    """Decorator to retry database operations on failure."""
+def retry_on_failure(retries=3, delay=2, max_delay=30, deadline=None,
+                     retry_if=is_transient):
+    """Decorator to retry database operations on transient failure.
+
+    retries  -- total attempts, including the first
+    delay    -- base backoff in seconds; attempt n sleeps a random time
+                between 0 and min(max_delay, delay * 2 ** (n - 1))
+    deadline -- overall seconds budget; no retry starts past it
+    retry_if -- predicate choosing which exceptions are retried; others
+                propagate immediately
+
+    Counters are available as wrapper.retry_stats.snapshot(). Coroutine
+    functions are retried with asyncio.sleep, so the loop keeps running.
+    """
+    backoff = functools.partial(
+        _backoff, retries=retries, delay=delay, max_delay=max_delay,
+        deadline=deadline, retry_if=retry_if)
+
     def decorator(func):
+        stats = RetryStats()
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                stats.add(calls=1)
+                start = time.monotonic()
+                attempt = 0
+                while True:
+                    try:
+                        return await func(*args, **kwargs)
+                    except Exception as e:
+                        attempt += 1
+                        pause = backoff(e, attempt, start, stats)
+                        if pause is None:
+                            raise
+                    await asyncio.sleep(pause)
+            async_wrapper.retry_stats = stats
+            return async_wrapper
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
+            stats.add(calls=1)
+            start = time.monotonic()
             attempt = 0
-            while attempt < retries:
+            while True:
                 try:
                     return func(*args, **kwargs)
                 except Exception as e:
                     attempt += 1
-                    print(f"[WARNING] Attempt {attempt} failed due to: {e}")
-                    if attempt < retries:
-                        print(f"Retrying in {delay} seconds...")
-                        time.sleep(delay)
-                    else:
-                        print("[ERROR] All retry attempts failed.")
+                    pause = backoff(e, attempt, start, stats)
+                    if pause is None:
                         raise
+                time.sleep(pause)
+        wrapper.retry_stats = stats
         return wrapper
     return decorator
 
@@ -1,47 +1,239 @@
 #!/usr/bin/env python3
+import json
 import time
-import sqlite3
+import inspect
 import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-# Global query cache
-query_cache = {}
+from cache_store import QueryCache
+from db_pool import with_db_connection
+from sql_utils import normalize_sql, read_tables
 
+# Global query cache used by the bare @cache_query form
+query_cache = QueryCache(maxsize=128)
 
-def with_db_connection(func):
-    """Decorator to automatically handle opening and closing the database connection."""
-    @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        conn = sqlite3.connect('users.db')
-        try:
-            result = func(conn, *args, **kwargs)
-        finally:
-            conn.close()
-        return result
-    return wrapper
-
-
-def cache_query(func):
-    """Decorator to cache query results to avoid redundant database calls."""
-    @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        # Get the SQL query string from args or kwargs
-        query = kwargs.get("query") if "query" in kwargs else (args[1] if len(args) > 1 else None)
-        if query in query_cache:
-            print(f"[CACHE] Returning cached result for query: {query}")
-            return query_cache[query]
-        # Execute the query and cache the result
-        result = func(*args, **kwargs)
-        query_cache[query] = result
+
+def _freeze(params):
+    """Turn bound parameters into a hashable part of the cache key.
+
+    Types are kept alongside values so 1, 1.0 and True do not collide.
+    """
+    if params is None:
+        return ()
+    if isinstance(params, dict):
+        return tuple(sorted((k, type(v), v) for k, v in params.items()))
+    return tuple((type(v), v) for v in params)
+
+
+def _thaw(frozen):
+    """Inverse of _freeze(): rebuild bound parameters from a cache key."""
+    if frozen and len(frozen[0]) == 3:
+        return {name: value for name, _, value in frozen}
+    return tuple(value for _, value in frozen)
+
+
+def cache_key(query, params=None):
+    """Cache key from the normalised SQL text and its bound parameters."""
+    key = (normalize_sql(query) if query else query, _freeze(params))
+    try:
+        hash(key)
+    except TypeError:
+        key = (key[0], repr(key[1]))
+    return key
+
+
+def _query_and_key(args, kwargs):
+    # Get the SQL query string and parameters from args or kwargs
+    query = kwargs.get("query") if "query" in kwargs else (args[1] if len(args) > 1 else None)
+    params = kwargs.get("params") if "params" in kwargs else (args[2] if len(args) > 2 else None)
+    return query, cache_key(query, params)
+
+
+def _report(query, hit):
+    if hit:
+        print(f"[CACHE] Returning cached result for query: {query}")
+    else:
         print(f"[CACHE] Stored result for query: {query}")
-        return result
-    return wrapper
+
+
+def cache_query(func=None, *, maxsize=128, maxbytes=None, ttl=None,
+                cache=None, backend=None, compact=False):
+    """Decorator to cache query results to avoid redundant database calls.
+
+    Used bare (@cache_query) it shares the global query_cache; called with
+    options (@cache_query(maxsize=..., maxbytes=..., ttl=...)) it gets a
+    private QueryCache with those limits. Pass backend=SQLiteBackend(path)
+    to share entries between worker processes through a local file, or
+    compact=True to keep results packed in memory (see stats()["bytes_saved"]).
+    The cache in use is exposed as wrapper.cache for inspecting counters.
+    Coroutine functions are cached too, with misses coalesced per loop.
+    """
+    if cache is None:
+        if func is not None:
+            cache = query_cache
+        else:
+            cache = QueryCache(maxsize=maxsize, maxbytes=maxbytes, ttl=ttl,
+                               backend=backend, compact=compact)
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                query, key = _query_and_key(args, kwargs)
+                result, hit = await cache.aget_or_load(
+                    key, lambda: func(*args, **kwargs),
+                    tables=read_tables(query)
+                )
+                _report(query, hit)
+                return result
+            async_wrapper.cache = cache
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            query, key = _query_and_key(args, kwargs)
+            # Execute the query on a miss; concurrent misses share one call
+            result, hit = cache.get_or_load(
+                key, lambda: func(*args, **kwargs), tables=read_tables(query)
+            )
+            _report(query, hit)
+            return result
+        wrapper.cache = cache
+        return wrapper
+
+    if func is not None:
+        return decorator(func)
+    return decorator
+
+
+class CacheWarmer:
+    """Preload hot queries into a cache_query cache and keep them warm.
+
+    func is the outermost decorated function, so each call gets its own
+    connection, and is called as func(query=..., params=...). Queries come
+    from register() or from a snapshot of a previous run's most-hit keys.
+
+    workers       -- threads used by warm() to load queries in parallel
+    refresh_ahead -- fraction of the TTL after which start()'s background
+                     thread reloads an entry, before readers see a miss
+    """
+
+    def __init__(self, func, cache=None, workers=4, refresh_ahead=0.8):
+        self.func = func
+        self.cache = cache if cache is not None else func.cache
+        self.workers = workers
+        self.refresh_ahead = refresh_ahead
+        self.queries = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self.refreshed = 0
+        self.errors = 0
+
+    def register(self, query, params=()):
+        """Add a query to the hot set."""
+        self.queries[cache_key(query, params)] = (query, params)
+
+    def save_snapshot(self, path, n=100):
+        """Write the cache's n most looked-up queries to a JSON file."""
+        hot = []
+        for query, frozen in self.cache.hot_keys(n):
+            # Keys of unhashable parameters were stored by repr
+            if not isinstance(frozen, tuple):
+                continue
+            entry = {"query": query, "params": _thaw(frozen)}
+            try:
+                json.dumps(entry)
+            except (TypeError, ValueError):
+                continue
+            hot.append(entry)
+        with open(path, "w") as f:
+            json.dump(hot, f, indent=2)
+        return len(hot)
+
+    def load_snapshot(self, path):
+        """Register every query saved by save_snapshot(); a missing file is fine."""
+        try:
+            with open(path) as f:
+                hot = json.load(f)
+        except FileNotFoundError:
+            return 0
+        for entry in hot:
+            params = entry["params"]
+            self.register(entry["query"],
+                          params if isinstance(params, dict) else tuple(params))
+        return len(hot)
+
+    def _load(self, query, params):
+        try:
+            # Warming traffic must not make its own queries look hot
+            with self.cache.uncounted():
+                self.func(query=query, params=params)
+            return True
+        except Exception as e:
+            self.errors += 1
+            print(f"[WARNING] Warming failed for query: {query} ({e})")
+            return False
+
+    def warm(self):
+        """Load every registered query not already cached, in parallel."""
+        start = time.monotonic()
+        pending = [entry for key, entry in self.queries.items()
+                   if key not in self.cache]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            loaded = sum(pool.map(lambda entry: self._load(*entry), pending))
+        print(f"[CACHE] Warmed {loaded} queries in "
+              f"{time.monotonic() - start:.3f}s")
+        return loaded
+
+    def _due(self, key):
+        left = self.cache.time_left(key)
+        if left is None:
+            return True
+        ttl = self.cache.ttl
+        return ttl is not None and left <= ttl * (1 - self.refresh_ahead)
+
+    def refresh(self):
+        """Reload registered queries that are missing or close to expiry."""
+        count = 0
+        for key, (query, params) in list(self.queries.items()):
+            if self._due(key):
+                with self.cache.refreshing():
+                    count += self._load(query, params)
+        self.refreshed += count
+        return count
+
+    def start(self, interval=None):
+        """Run refresh() every interval seconds in a daemon thread.
+
+        The default checks twice per refresh window, or every 5s without
+        a TTL (then only invalidated or evicted queries are reloaded).
+        """
+        if interval is None:
+            ttl = self.cache.ttl
+            interval = ttl * (1 - self.refresh_ahead) / 2 if ttl else 5.0
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(interval,), name="cache-warmer",
+            daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            self.refresh()
 
 
 @with_db_connection
 @cache_query
-def fetch_users_with_cache(conn, query):
+def fetch_users_with_cache(conn, query, params=()):
     cursor = conn.cursor()
-    cursor.execute(query)
+    cursor.execute(query, params)
     return cursor.fetchall()
 
 
@@ -53,3 +245,4 @@ if __name__ == "__main__":
     users_again = fetch_users_with_cache(query="SELECT * FROM users")
 
     print(users_again)
+    print(query_cache.stats())
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""Per-call overhead of stacked decorators versus a db_stack fused wrapper.
+
+Runs a point query against an in-memory-sized scratch users table so the
+decorator cost is a visible share of each call.
+
+Usage: ./bench_decorator_stack.py [calls]
+"""
+import io
+import os
+import sys
+import tempfile
+import time
+
+from cache_store import QueryCache
+from db_pool import ConnectionPool, with_db_connection
+from db_stack import db_stack
+
+log_queries = __import__("0-log_queries")
+transactional = __import__("2-transactional").transactional
+retry_on_failure = __import__("3-retry_on_failure").retry_on_failure
+cache_query = __import__("4-cache_query").cache_query
+
+
+def point_query(conn, query, params=()):
+    return conn.execute(query, params).fetchone()
+
+
+def build(pool, writer):
+    bare = with_db_connection(point_query, pool=pool)
+    fused_bare = db_stack(pool=pool)(point_query)
+    tx_stacked = with_db_connection(
+        transactional(retry_on_failure(retries=3, delay=0.01)(point_query)),
+        pool=pool)
+    tx_fused = db_stack(retry={"retries": 3, "delay": 0.01},
+                        transactional=True, pool=pool)(point_query)
+    stacked = log_queries.log_queries(
+        with_db_connection(retry_on_failure(retries=3, delay=0.01)(point_query),
+                           pool=pool),
+        writer=writer)
+    fused = db_stack(log=writer, retry={"retries": 3, "delay": 0.01},
+                     pool=pool)(point_query)
+    cached_stacked = with_db_connection(
+        cache_query(cache=QueryCache(maxsize=1024))(point_query), pool=pool)
+    cached_fused = db_stack(cache=QueryCache(maxsize=1024),
+                            pool=pool)(point_query)
+    return [
+        ("connection", bare, fused_bare),
+        ("log+retry+conn", stacked, fused),
+        ("conn+tx+retry", tx_stacked, tx_fused),
+        ("cache hit", cached_stacked, cached_fused),
+    ]
+
+
+def per_call_us(fn, calls, writer, repeat=5):
+    """Best of `repeat` runs, in microseconds per call."""
+    query = "SELECT * FROM users WHERE id = ?"
+    best = float("inf")
+    for _ in range(repeat):
+        writer.flush()
+        start = time.perf_counter()
+        for i in range(calls):
+            fn(query, (i % 100 + 1,))
+        best = min(best, time.perf_counter() - start)
+    return best / calls * 1e6
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "users.db")
+        pool = ConnectionPool(path)
+        with pool.connection() as conn:
+            conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY,"
+                         " name TEXT, email TEXT, age INTEGER)")
+            conn.executemany("INSERT INTO users VALUES (?, ?, ?, ?)",
+                             [(i, f"u{i}", f"u{i}@x", 20 + i % 50)
+                              for i in range(1, 101)])
+            conn.commit()
+        # Long interval: keep the writer thread asleep while timing
+        writer = log_queries.QueryLogWriter(stream=io.StringIO(),
+                                            flush_interval=3600)
+        stdout = sys.stdout
+        with pool.connection() as conn:
+            baseline = per_call_us(
+                lambda query, params: point_query(conn, query, params),
+                calls, writer)
+        print(f"undecorated query: {baseline:.2f} us/call")
+        print(f"{'stack':<16} {'stacked us':>11} {'fused us':>9}")
+        for label, stacked, fused in build(pool, writer):
+            sys.stdout = io.StringIO()  # cache_query prints on every call
+            try:
+                before = per_call_us(stacked, calls, writer)
+                after = per_call_us(fused, calls, writer)
+            finally:
+                sys.stdout = stdout
+            print(f"{label:<16} {before:>11.2f} {after:>9.2f}")
+        writer.close()
+        pool.close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""Compare the sqlite_utils connection profiles on a scratch users table.
+
+Usage: ./bench_profiles.py [rows]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlite_utils import PROFILES, connect
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def bench(profile, rows, workdir):
+    path = os.path.join(workdir, f"{profile}.db")
+    conn = connect(path, profile)
+    conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT,"
+                 " email TEXT, age INTEGER)")
+    data = [(i, f"user{i}", f"user{i}@example.com", 18 + i % 60)
+            for i in range(1, rows + 1)]
+
+    def insert():
+        # Small transactions, as produced by @transactional callers
+        for start in range(0, rows, 100):
+            conn.executemany("INSERT INTO users VALUES (?, ?, ?, ?)",
+                             data[start:start + 100])
+            conn.commit()
+
+    ids = [random.randint(1, rows) for _ in range(5000)]
+
+    def point_reads():
+        for user_id in ids:
+            conn.execute("SELECT * FROM users WHERE id = ?",
+                         (user_id,)).fetchone()
+
+    def scans():
+        for _ in range(20):
+            conn.execute("SELECT * FROM users WHERE age > 40").fetchall()
+
+    result = (timed(insert), timed(point_reads), timed(scans))
+    conn.close()
+    return result
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    print(f"{'profile':<12} {'insert s':>10} {'5k reads s':>11} {'20 scans s':>11}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for profile in PROFILES:
+            insert, reads, scan = bench(profile, rows, workdir)
+            print(f"{profile:<12} {insert:>10.3f} {reads:>11.3f} {scan:>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,677 @@
+#!/usr/bin/env python3
+"""Bounded stores backing the cache_query decorator.
+
+QueryCache handles locking, counters, single-flight loads and TTLs, and
+keeps entries in a backend: MemoryBackend (private to the process) or
+SQLiteBackend (a file shared by every worker process on the host).
+"""
+import sys
+import time
+import asyncio
+import marshal
+import pickle
+import sqlite3
+import threading
+import weakref
+import zlib
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+from sql_utils import ALL_TABLES
+
+
+_MISSING = object()
+
+# Every live QueryCache, so committed writes can invalidate all of them
+_caches = weakref.WeakSet()
+
+# Distinct keys whose lookup counts are kept for QueryCache.hot_keys()
+HOT_KEY_LIMIT = 10000
+
+
+def estimate_size(value):
+    """Rough size in bytes of a query result (list of row tuples)."""
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        for row in value:
+            size += sys.getsizeof(row)
+            if isinstance(row, (list, tuple)):
+                size += sum(sys.getsizeof(item) for item in row)
+    return size
+
+
+# Compact encodings are tagged with one byte: marshal, pickle, or zlib
+COMPACT_COMPRESS_OVER = 1024
+
+
+def pack(value, compress=False):
+    """Encode a query result as one bytes object (see MemoryBackend)."""
+    try:
+        # marshal is far faster than pickle for tuples of plain values
+        data = b"m" + marshal.dumps(value)
+    except ValueError:
+        data = b"p" + pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    if compress and len(data) > COMPACT_COMPRESS_OVER:
+        return b"z" + zlib.compress(data, 1)
+    return data
+
+
+def unpack(data):
+    if data[:1] == b"z":
+        data = zlib.decompress(data[1:])
+    if data[:1] == b"m":
+        return marshal.loads(data[1:])
+    return pickle.loads(data[1:])
+
+
+class _Entry:
+    __slots__ = ("value", "size", "raw_size", "expires", "tables")
+
+    def __init__(self, value, size, raw_size, expires, tables):
+        self.value = value
+        self.size = size
+        self.raw_size = raw_size
+        self.expires = expires
+        self.tables = tables
+
+
+class MemoryBackend:
+    """In-process LRU store with entry-count and byte limits.
+
+    With compact=True results are kept as a single bytes object (see pack)
+    instead of a list of row tuples and decoded only when a hit returns
+    them, so every hit gets its own copy. compact="zlib" also compresses
+    larger results: about 4x smaller again, at twice the decode cost.
+    maxbytes then counts the compact size; raw_bytes tracks what the same
+    entries would take unpacked.
+
+    Not locked on its own; QueryCache serialises access to it.
+    """
+
+    def __init__(self, maxsize=128, maxbytes=None, compact=False):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.compact = compact
+        self._entries = OrderedDict()
+        self._by_table = {}
+        self.nbytes = 0
+        self.raw_bytes = 0
+        self.evictions = 0
+
+    def get(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+        if entry.expires is not None and entry.expires <= now:
+            self._remove(key)
+            self.evictions += 1
+            return _MISSING
+        self._entries.move_to_end(key)
+        return unpack(entry.value) if self.compact else entry.value
+
+    def expires_at(self, key, now):
+        """Expiry time of a live entry (None if it never expires)."""
+        entry = self._entries.get(key)
+        if entry is None or (entry.expires is not None and entry.expires <= now):
+            return _MISSING
+        return entry.expires
+
+    def set(self, key, value, expires, tables):
+        size = raw_size = estimate_size(value)
+        if self.compact:
+            value = pack(value, compress=self.compact == "zlib")
+            size = sys.getsizeof(value)
+        if key in self._entries:
+            self._remove(key)
+        if self.maxbytes is not None and size > self.maxbytes:
+            # Never cache a single result larger than the whole budget
+            return
+        self._entries[key] = _Entry(value, size, raw_size, expires, tables)
+        self.nbytes += size
+        self.raw_bytes += raw_size
+        for table in tables:
+            self._by_table.setdefault(table, set()).add(key)
+        self._evict()
+
+    def delete(self, key):
+        if key in self._entries:
+            self._remove(key)
+
+    def invalidate_tables(self, tables):
+        """Drop entries reading any of tables; return how many went."""
+        if ALL_TABLES in tables:
+            count = len(self._entries)
+            self.clear()
+            return count
+        keys = set(self._by_table.get(ALL_TABLES, ()))
+        for table in tables:
+            keys.update(self._by_table.get(table, ()))
+        for key in keys:
+            self._remove(key)
+        return len(keys)
+
+    def clear(self):
+        self._entries.clear()
+        self._by_table.clear()
+        self.nbytes = 0
+        self.raw_bytes = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.nbytes -= entry.size
+        self.raw_bytes -= entry.raw_size
+        for table in entry.tables:
+            keys = self._by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[table]
+
+    def _evict(self):
+        while self._entries and (
+            (self.maxsize is not None and len(self._entries) > self.maxsize)
+            or (self.maxbytes is not None and self.nbytes > self.maxbytes)
+        ):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def __contains__(self, key):
+        entry = self._entries.get(key)
+        return entry is not None and (
+            entry.expires is None or entry.expires > time.time()
+        )
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteBackend:
+    """LRU store in a sqlite file that several processes can share.
+
+    Results are pickled and zlib-compressed; keys are stored by repr so
+    every process maps the same query and parameters to the same row.
+    Entries survive restarts, so a new worker starts with a warm cache.
+    """
+
+    # Compress serialised results larger than this many bytes
+    COMPRESS_OVER = 512
+
+    def __init__(self, path="query_cache.db", maxsize=10000, maxbytes=None):
+        self.path = path
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.evictions = 0
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires REAL,
+                    accessed REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS cache_entries_accessed
+                    ON cache_entries (accessed);
+                CREATE TABLE IF NOT EXISTS cache_tags (
+                    tbl TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    PRIMARY KEY (tbl, key)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS cache_tags_key ON cache_tags (key);
+            """)
+            # Running entry count and size, kept by triggers so every
+            # process sharing the file sees the same totals without a scan
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS cache_stats (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    entries INTEGER NOT NULL,
+                    bytes INTEGER NOT NULL
+                );
+                CREATE TRIGGER IF NOT EXISTS cache_entries_added
+                AFTER INSERT ON cache_entries BEGIN
+                    UPDATE cache_stats
+                    SET entries = entries + 1, bytes = bytes + NEW.size;
+                END;
+                CREATE TRIGGER IF NOT EXISTS cache_entries_removed
+                AFTER DELETE ON cache_entries BEGIN
+                    UPDATE cache_stats
+                    SET entries = entries - 1, bytes = bytes - OLD.size;
+                END;
+                INSERT OR IGNORE INTO cache_stats
+                    SELECT 0, COUNT(*), COALESCE(SUM(size), 0)
+                    FROM cache_entries;
+            """)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @classmethod
+    def dumps(cls, value):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > cls.COMPRESS_OVER:
+            return b"z" + zlib.compress(data)
+        return b"p" + data
+
+    @staticmethod
+    def loads(blob):
+        data = bytes(blob)
+        if data[:1] == b"z":
+            return pickle.loads(zlib.decompress(data[1:]))
+        return pickle.loads(data[1:])
+
+    def get(self, key, now):
+        conn = self._conn()
+        key = repr(key)
+        row = conn.execute(
+            "SELECT value, expires, accessed FROM cache_entries WHERE key = ?",
+            (key,),
+        ).fetchone()
+        if row is None:
+            return _MISSING
+        blob, expires, accessed = row
+        with conn:
+            if expires is not None and expires <= now:
+                self._delete(conn, key)
+                self.evictions += 1
+                return _MISSING
+            # Refresh LRU order at most once a second per entry
+            if now - accessed > 1.0:
+                conn.execute(
+                    "UPDATE cache_entries SET accessed = ? WHERE key = ?",
+                    (now, key),
+                )
+        return self.loads(blob)
+
+    def expires_at(self, key, now):
+        """Expiry time of a live entry (None if it never expires)."""
+        row = self._conn().execute(
+            "SELECT expires FROM cache_entries WHERE key = ?", (repr(key),)
+        ).fetchone()
+        if row is None or (row[0] is not None and row[0] <= now):
+            return _MISSING
+        return row[0]
+
+    def set(self, key, value, expires, tables):
+        blob = self.dumps(value)
+        if self.maxbytes is not None and len(blob) > self.maxbytes:
+            return
+        key = repr(key)
+        conn = self._conn()
+        with conn:
+            self._delete(conn, key)
+            conn.execute(
+                "INSERT INTO cache_entries VALUES (?, ?, ?, ?, ?)",
+                (key, blob, len(blob), expires, time.time()),
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO cache_tags VALUES (?, ?)",
+                [(table, key) for table in tables],
+            )
+            self._evict(conn)
+
+    def delete(self, key):
+        conn = self._conn()
+        with conn:
+            self._delete(conn, repr(key))
+
+    def invalidate_tables(self, tables):
+        """Drop entries reading any of tables; return how many went."""
+        conn = self._conn()
+        with conn:
+            if ALL_TABLES in tables:
+                count = conn.execute(
+                    "SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+                conn.execute("DELETE FROM cache_entries")
+                conn.execute("DELETE FROM cache_tags")
+                return count
+            names = list(tables) + [ALL_TABLES]
+            marks = ",".join("?" * len(names))
+            keys = [row[0] for row in conn.execute(
+                f"SELECT DISTINCT key FROM cache_tags WHERE tbl IN ({marks})",
+                names,
+            )]
+            for key in keys:
+                self._delete(conn, key)
+            return len(keys)
+
+    def clear(self):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM cache_entries")
+            conn.execute("DELETE FROM cache_tags")
+
+    @property
+    def nbytes(self):
+        return self._conn().execute(
+            "SELECT bytes FROM cache_stats").fetchone()[0]
+
+    def _delete(self, conn, key):
+        conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+        conn.execute("DELETE FROM cache_tags WHERE key = ?", (key,))
+
+    def _evict(self, conn):
+        entries, nbytes = conn.execute(
+            "SELECT entries, bytes FROM cache_stats").fetchone()
+
+        def over():
+            return (self.maxsize is not None and entries > self.maxsize) or (
+                self.maxbytes is not None and nbytes > self.maxbytes)
+
+        if not over():
+            return
+        # Walk from the least recently used end only as far as needed
+        victims = []
+        cursor = conn.execute(
+            "SELECT key, size FROM cache_entries ORDER BY accessed")
+        for key, size in cursor:
+            victims.append(key)
+            entries -= 1
+            nbytes -= size
+            if not over():
+                break
+        cursor.close()
+        for key in victims:
+            self._delete(conn, key)
+        self.evictions += len(victims)
+
+    def __contains__(self, key):
+        row = self._conn().execute(
+            "SELECT expires FROM cache_entries WHERE key = ?", (repr(key),)
+        ).fetchone()
+        return row is not None and (row[0] is None or row[0] > time.time())
+
+    def __len__(self):
+        return self._conn().execute(
+            "SELECT entries FROM cache_stats").fetchone()[0]
+
+
+class _Flight:
+    """A load in progress that concurrent callers wait on."""
+    __slots__ = ("done", "value", "error", "tables", "stale")
+
+    def __init__(self, tables):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.tables = tables
+        self.stale = False
+
+
+class _AsyncFlight:
+    """A coroutine load in progress that other tasks await."""
+    __slots__ = ("future", "tables", "stale")
+
+    def __init__(self, tables):
+        self.future = asyncio.get_running_loop().create_future()
+        self.tables = tables
+        self.stale = False
+
+
+class QueryCache:
+    """Thread-safe LRU cache with optional entry-count, byte and TTL limits.
+
+    maxsize  -- maximum number of entries (None for unbounded)
+    maxbytes -- maximum estimated size of all cached results
+    ttl      -- seconds an entry stays valid (None never expires)
+    backend  -- where entries live; a MemoryBackend built from maxsize,
+                maxbytes and compact by default
+    compact  -- store results packed (see MemoryBackend)
+    """
+
+    def __init__(self, maxsize=128, maxbytes=None, ttl=None, backend=None,
+                 compact=False):
+        self.ttl = ttl
+        self.backend = backend if backend is not None \
+            else MemoryBackend(maxsize=maxsize, maxbytes=maxbytes,
+                               compact=compact)
+        self._inflight = {}
+        self._async_inflight = {}
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.coalesced = 0
+        self.lookups = Counter()
+        self._local = threading.local()
+        _caches.add(self)
+
+    def get(self, key, default=None):
+        """Return the cached value for key, counting a hit or a miss."""
+        with self._lock:
+            return self._get(key, default)
+
+    def set(self, key, value, ttl=None, tables=(ALL_TABLES,)):
+        """Store value under key and evict least recently used entries.
+
+        tables names what the query reads; a write to any of them drops
+        the entry. The default tag is invalidated by every write.
+        """
+        with self._lock:
+            self._set(key, value, ttl, frozenset(tables))
+
+    def get_or_load(self, key, loader, tables=(ALL_TABLES,)):
+        """Return (value, hit), calling loader() on a miss.
+
+        Concurrent misses for the same key are coalesced: the first caller
+        runs loader and the others wait for its result (or exception).
+        """
+        tables = frozenset(tables)
+        refresh = getattr(self._local, "refresh", False)
+        with self._lock:
+            if not refresh:
+                value = self._lookup(key)
+                if value is not _MISSING:
+                    self._count(key, True)
+                    return value, True
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight(tables)
+            else:
+                self.coalesced += 1
+            if not refresh:
+                # A waiter is served without a query of its own: a hit
+                self._count(key, not leader)
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value, True
+        try:
+            flight.value = loader()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            try:
+                with self._lock:
+                    del self._inflight[key]
+                    # A write committed mid-load may have made the value stale
+                    if flight.error is None and not flight.stale:
+                        self._store(key, flight.value, tables)
+            finally:
+                flight.done.set()
+        return flight.value, False
+
+    async def aget_or_load(self, key, loader, tables=(ALL_TABLES,)):
+        """Coroutine form of get_or_load(); loader is a coroutine function.
+
+        Concurrent misses from tasks on the same event loop share one
+        loader call. Waiters are shielded, so cancelling one of them does
+        not cancel the shared load.
+        """
+        tables = frozenset(tables)
+        # Futures belong to one loop: tasks on other loops load separately
+        slot = (asyncio.get_running_loop(), key)
+        with self._lock:
+            value = self._lookup(key)
+            if value is not _MISSING:
+                self._count(key, True)
+                return value, True
+            flight = self._async_inflight.get(slot)
+            leader = flight is None
+            if leader:
+                flight = self._async_inflight[slot] = _AsyncFlight(tables)
+            else:
+                self.coalesced += 1
+            self._count(key, not leader)
+        if not leader:
+            return await asyncio.shield(flight.future), True
+        future = flight.future
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark retrieved: the leader re-raises it even with no waiters
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+        finally:
+            with self._lock:
+                del self._async_inflight[slot]
+                if future.done() and not future.cancelled() \
+                        and future.exception() is None and not flight.stale:
+                    self._store(key, value, tables)
+        return value, False
+
+    @contextmanager
+    def refreshing(self):
+        """Within this block, get_or_load() in this thread reloads hits.
+
+        Other threads keep being served the current entry until the new
+        value replaces it; used for refresh-ahead (see CacheWarmer).
+        """
+        previous = getattr(self._local, "refresh", False)
+        self._local.refresh = True
+        try:
+            yield self
+        finally:
+            self._local.refresh = previous
+
+    @contextmanager
+    def uncounted(self):
+        """Within this block, lookups in this thread are not counted.
+
+        They are left out of hot_keys() and the hit/miss counters, so
+        background loads (see CacheWarmer) do not skew either.
+        """
+        previous = getattr(self._local, "uncounted", False)
+        self._local.uncounted = True
+        try:
+            yield self
+        finally:
+            self._local.uncounted = previous
+
+    def hot_keys(self, n=100):
+        """Return the n most looked-up keys, most popular first."""
+        with self._lock:
+            return [key for key, _ in self.lookups.most_common(n)]
+
+    def time_left(self, key):
+        """Seconds until key expires: None if absent, inf if no TTL."""
+        now = time.time()
+        with self._lock:
+            expires = self.backend.expires_at(key, now)
+        if expires is _MISSING:
+            return None
+        return float("inf") if expires is None else expires - now
+
+    def _get(self, key, default):
+        value = self._lookup(key)
+        self._count(key, value is not _MISSING)
+        return default if value is _MISSING else value
+
+    def _lookup(self, key):
+        return self.backend.get(key, time.time())
+
+    def _count(self, key, hit):
+        if getattr(self._local, "uncounted", False):
+            return
+        lookups = self.lookups
+        lookups[key] += 1
+        if len(lookups) > HOT_KEY_LIMIT:
+            self.lookups = Counter(dict(lookups.most_common(HOT_KEY_LIMIT // 2)))
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def _store(self, key, value, tables):
+        # The load itself succeeded: a value the backend cannot store
+        # (unpicklable, or the shared file is locked) is just not cached
+        try:
+            self._set(key, value, None, tables)
+        except Exception as e:
+            print(f"[WARNING] Could not cache result for key {key!r}: {e}")
+
+    def _set(self, key, value, ttl, tables):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.time() + ttl if ttl is not None else None
+        self.backend.set(key, value, expires, tables)
+
+    def invalidate(self, key):
+        """Drop a single entry if present."""
+        with self._lock:
+            self.backend.delete(key)
+
+    def invalidate_tables(self, tables):
+        """Drop every entry that reads from any of the given tables."""
+        with self._lock:
+            flights = list(self._inflight.values())
+            flights += self._async_inflight.values()
+            for flight in flights:
+                if ALL_TABLES in tables or ALL_TABLES in flight.tables \
+                        or not flight.tables.isdisjoint(tables):
+                    flight.stale = True
+            self.invalidations += self.backend.invalidate_tables(tables)
+
+    def clear(self):
+        """Drop every entry, keeping the counters."""
+        with self._lock:
+            self.backend.clear()
+
+    def stats(self):
+        """Return a snapshot of the cache counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.backend.evictions,
+                "invalidations": self.invalidations,
+                "coalesced": self.coalesced,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.backend),
+                "bytes": self.backend.nbytes,
+            }
+            raw_bytes = getattr(self.backend, "raw_bytes", None)
+            if raw_bytes is not None:
+                stats["raw_bytes"] = raw_bytes
+                stats["bytes_saved"] = raw_bytes - stats["bytes"]
+            return stats
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self.backend
+
+    def __len__(self):
+        return len(self.backend)
+
+
+def invalidate_tables(tables):
+    """Invalidate entries reading any of tables in every QueryCache."""
+    if not tables:
+        return
+    for cache in list(_caches):
+        cache.invalidate_tables(tables)
@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""Thread-local sqlite connection pool shared by the decorator modules."""
+import sqlite3
+import asyncio
+import inspect
+import functools
+import threading
+import time
+import contextvars
+from contextlib import asynccontextmanager, contextmanager
+
+from sqlite_utils import (async_statement_timeout, connect, connect_readonly,
+                          get_writer, is_read_only, profile_statements,
+                          statement_timeout)
+
+
+class _Slot:
+    """The pooled connection owned by one thread."""
+    __slots__ = ("conn", "thread", "depth", "last_used", "last_checked")
+
+    def __init__(self, conn, thread, now):
+        self.conn = conn
+        self.thread = thread
+        self.depth = 0
+        self.last_used = now
+        self.last_checked = now
+
+
+class ConnectionPool:
+    """Reuse one sqlite connection per thread instead of reconnecting.
+
+    size           -- most pooled connections open at once; threads beyond
+                      that get a connection that is closed after use
+    idle_timeout   -- seconds unused before a connection is reopened
+    check_interval -- seconds between liveness checks (SELECT 1) on reuse
+    profile        -- sqlite_utils profile applied to each new connection
+    read_only      -- open connections with mode=ro (see ConnectionRouter)
+    """
+
+    def __init__(self, database="users.db", size=8, idle_timeout=60.0,
+                 check_interval=5.0, profile=None, read_only=False,
+                 **connect_kwargs):
+        self.database = database
+        self.profile = profile
+        self.read_only = read_only
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self.connect_kwargs = connect_kwargs
+        self._local = threading.local()
+        self._slots = {}
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+        self.overflow = 0
+        self.recycled = 0
+
+    def _connect(self):
+        # Connections may be closed by prune_idle() from another thread
+        opener = connect_readonly if self.read_only else connect
+        return opener(self.database, self.profile, check_same_thread=False,
+                      **self.connect_kwargs)
+
+    def acquire(self):
+        """Return this thread's connection, opening it if needed.
+
+        Calls nest: an inner acquire in the same thread gets the same
+        connection, and only the outermost release hands it back.
+        """
+        slot = getattr(self._local, "slot", None)
+        if slot is not None and slot.depth:
+            # Already in use by this thread, so the pruner leaves it alone
+            slot.depth += 1
+            self.reused += 1
+            return slot.conn
+        now = time.monotonic()
+        if slot is not None:
+            # Claim the idle slot under the lock before touching it, so
+            # another thread's prune cannot close it underneath us
+            with self._lock:
+                claimed = slot.conn is not None
+                if claimed:
+                    slot.depth = 1
+            if claimed:
+                if self._usable(slot, now):
+                    self.reused += 1
+                    return slot.conn
+                self._discard(slot)
+        with self._lock:
+            if len(self._slots) >= self.size:
+                self._prune_locked(now)
+            if len(self._slots) >= self.size:
+                self.overflow += 1
+                return self._connect()
+            slot = _Slot(self._connect(), threading.current_thread(), now)
+            slot.depth = 1
+            self._slots[id(slot)] = slot
+            self.opened += 1
+        self._local.slot = slot
+        return slot.conn
+
+    def release(self, conn):
+        """Hand a connection back; overflow connections are closed."""
+        slot = getattr(self._local, "slot", None)
+        if slot is None or slot.conn is not conn:
+            conn.close()
+            return
+        if slot.depth > 1:
+            slot.depth -= 1
+            return
+        # Never leak an unfinished transaction to the next caller
+        if conn.in_transaction:
+            conn.rollback()
+        slot.last_used = time.monotonic()
+        with self._lock:
+            slot.depth = 0
+
+    @contextmanager
+    def connection(self):
+        """Context manager form of acquire()/release()."""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def prune_idle(self):
+        """Close connections that are idle too long or whose thread exited."""
+        with self._lock:
+            self._prune_locked(time.monotonic())
+
+    def close_all(self):
+        """Close every idle pooled connection."""
+        with self._lock:
+            for slot in list(self._slots.values()):
+                if slot.depth == 0:
+                    self._close_locked(slot)
+
+    def stats(self):
+        """Return a snapshot of the pool counters."""
+        return {
+            "open": len(self._slots),
+            "opened": self.opened,
+            "reused": self.reused,
+            "overflow": self.overflow,
+            "recycled": self.recycled,
+        }
+
+    def _usable(self, slot, now):
+        if now - slot.last_used > self.idle_timeout:
+            return False
+        if now - slot.last_checked > self.check_interval:
+            try:
+                slot.conn.execute("SELECT 1")
+            except sqlite3.Error:
+                return False
+            slot.last_checked = now
+        return True
+
+    def _discard(self, slot):
+        with self._lock:
+            slot.depth = 0
+            self._close_locked(slot)
+        self.recycled += 1
+
+    def _prune_locked(self, now):
+        for slot in list(self._slots.values()):
+            if slot.depth == 0 and (
+                not slot.thread.is_alive()
+                or now - slot.last_used > self.idle_timeout
+            ):
+                self._close_locked(slot)
+                self.recycled += 1
+
+    def _close_locked(self, slot):
+        self._slots.pop(id(slot), None)
+        if slot.conn is not None:
+            try:
+                slot.conn.close()
+            except sqlite3.Error:
+                pass
+            slot.conn = None
+
+
+class ConnectionRouter:
+    """Route read-only statements to a mode=ro pool and writes to one writer.
+
+    Readers never queue behind the writer (WAL), and writes are serialised
+    through the process-wide SerialWriter for the file (get_writer()), the
+    same one DatabaseConnection(route="write") uses, instead of contending
+    for the file lock.
+    A thread holding the writer keeps using it for reads, so it sees its
+    own uncommitted changes.
+    """
+
+    def __init__(self, database="users.db", size=8, profile="balanced",
+                 **pool_kwargs):
+        self.database = database
+        self.writer = get_writer(database, profile)
+        self.reader = ConnectionPool(database, size, profile=profile,
+                                     read_only=True, **pool_kwargs)
+        self._writer_opened = False
+        self.reads = 0
+        self.writes = 0
+
+    def route(self, query=None, read_only=None):
+        """Return the pool for a call; read_only=None inspects query."""
+        if self.writer.held():
+            self.writes += 1
+            return self.writer
+        if read_only is None:
+            read_only = query is not None and is_read_only(query)
+        if not read_only:
+            self.writes += 1
+            return self.writer
+        if not self._writer_opened:
+            # The writer applies the profile's journal_mode (WAL) to the file
+            self.writer.open()
+            self._writer_opened = True
+        self.reads += 1
+        return self.reader
+
+    def close_all(self):
+        self.reader.close_all()
+        self.writer.close()
+
+    def stats(self):
+        return {
+            "reads": self.reads,
+            "writes": self.writes,
+            "reader": self.reader.stats(),
+            "writer": self.writer.stats(),
+        }
+
+
+class _Lease:
+    """The connection an asyncio task holds from an AsyncConnectionPool."""
+    __slots__ = ("conn", "task", "depth")
+
+    def __init__(self, conn, task):
+        self.conn = conn
+        self.task = task
+        self.depth = 1
+
+
+class AsyncConnectionPool:
+    """Pool of aiosqlite connections for coroutine code paths.
+
+    At most size connections are handed out at once; further acquires wait.
+    As with ConnectionPool, nested acquires within one task reuse the
+    task's connection. At most max_idle released connections are kept.
+
+    aiosqlite runs each connection on a non-daemon thread, so idle
+    connections must be closed before the interpreter can exit. Under
+    asyncio.run() that happens automatically when the loop shuts down;
+    code managing its own loop should await close_all() before closing it.
+    """
+
+    def __init__(self, database="users.db", size=8, profile=None,
+                 max_idle=2):
+        self.database = database
+        self.size = size
+        self.profile = profile
+        self.max_idle = max_idle
+        self._idle = []
+        self._slots = None
+        self._loop = None
+        self._closer = None
+        self._current = contextvars.ContextVar(
+            f"async_pool_{id(self)}", default=None)
+        self.opened = 0
+        self.reused = 0
+
+    async def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Semaphores and connections belong to one event loop; stop the
+            # worker threads of any left over from a previous loop
+            for conn in self._idle:
+                conn.stop()
+            self._loop = loop
+            self._slots = asyncio.Semaphore(self.size)
+            self._idle = []
+            # asyncio.run() closes live async generators before it closes
+            # the loop, which runs this one's cleanup while awaits still work
+            self._closer = self._close_on_shutdown(loop)
+            await self._closer.__anext__()
+
+    async def _close_on_shutdown(self, loop):
+        try:
+            yield
+        finally:
+            if self._loop is loop:
+                await self.close_all()
+
+    async def acquire(self):
+        lease = self._current.get()
+        task = asyncio.current_task()
+        if lease is not None and lease.task is task:
+            lease.depth += 1
+            self.reused += 1
+            return lease.conn
+        await self._bind_loop()
+        await self._slots.acquire()
+        try:
+            if self._idle:
+                conn = self._idle.pop()
+                self.reused += 1
+            else:
+                import aiosqlite
+                conn = await aiosqlite.connect(self.database)
+                for statement in profile_statements(self.profile):
+                    await conn.execute(statement)
+                self.opened += 1
+        except BaseException:
+            self._slots.release()
+            raise
+        self._current.set(_Lease(conn, task))
+        return conn
+
+    async def release(self, conn):
+        lease = self._current.get()
+        if lease is None or lease.conn is not conn:
+            return
+        lease.depth -= 1
+        if lease.depth:
+            return
+        self._current.set(None)
+        try:
+            if conn.in_transaction:
+                await conn.rollback()
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+            else:
+                await conn.close()
+        except Exception:
+            await conn.close()
+        finally:
+            self._slots.release()
+
+    @asynccontextmanager
+    async def connection(self):
+        conn = await self.acquire()
+        try:
+            yield conn
+        finally:
+            await self.release(conn)
+
+    async def close_all(self):
+        """Close every idle connection (and stop its worker thread)."""
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            await conn.close()
+
+
+# Pools shared by every module that talks to users.db
+default_pool = ConnectionPool("users.db")
+default_async_pool = AsyncConnectionPool("users.db")
+default_router = ConnectionRouter("users.db")
+
+
+def _query_arg(args, kwargs):
+    if "query" in kwargs:
+        return kwargs["query"]
+    return args[0] if args and isinstance(args[0], str) else None
+
+
+def with_db_connection(func=None, *, pool=None, query_timeout=None,
+                       read_only=None):
+    """Decorator to pass a pooled database connection as the first argument.
+
+    Used bare it draws from default_pool, or default_async_pool when
+    decorating a coroutine function; @with_db_connection(pool=...)
+    selects another pool. With query_timeout (seconds) set, statements
+    still running past it are interrupted and raise QueryTimeout.
+
+    With pool=default_router (or another ConnectionRouter) each call gets a
+    read-only or the writer connection: read_only=True/False fixes the
+    choice, None routes on the query argument (unknown means writer).
+    Routing applies to synchronous functions only.
+    """
+    def decorator(func):
+        routed = isinstance(pool, ConnectionRouter)
+        if inspect.iscoroutinefunction(func):
+            if routed:
+                raise TypeError("ConnectionRouter only serves synchronous functions")
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                active = pool if pool is not None else default_async_pool
+                conn = await active.acquire()
+                try:
+                    async with async_statement_timeout(conn, query_timeout):
+                        return await func(conn, *args, **kwargs)
+                finally:
+                    await active.release(conn)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            active = pool if pool is not None else default_pool
+            if routed:
+                active = pool.route(_query_arg(args, kwargs), read_only)
+            conn = active.acquire()
+            try:
+                with statement_timeout(conn, query_timeout):
+                    return func(conn, *args, **kwargs)
+            finally:
+                active.release(conn)
+        return wrapper
+
+    if func is not None:
+        return decorator(func)
+    return decorator
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""Declare a decorator stack once and get a single fused wrapper.
+
+    @db_stack(log=True, cache=True, retry={"retries": 3, "delay": 0.1})
+    def fetch_users(conn, query, params=()):
+        ...
+
+behaves like log_queries + cache_query + retry_on_failure +
+with_db_connection (+ transactional) stacked in that order, but runs in
+one Python frame: query and params positions are resolved once at
+decoration time, and the connection, transaction and retry loop share
+the same call.
+"""
+import time
+import inspect
+import functools
+
+from db_pool import ConnectionRouter, default_pool
+from sqlite_utils import statement_timeout
+
+_log_queries = __import__("0-log_queries")
+_transactional = __import__("2-transactional")
+_retry = __import__("3-retry_on_failure")
+_cache_query = __import__("4-cache_query")
+
+
+def _locator(func, name):
+    """Return a getter for argument `name` as seen by callers (no conn)."""
+    params = list(inspect.signature(func).parameters)[1:]
+    if name not in params:
+        return lambda args, kwargs: kwargs.get(name)
+    index = params.index(name)
+
+    def get(args, kwargs):
+        if name in kwargs:
+            return kwargs[name]
+        return args[index] if len(args) > index else None
+    return get
+
+
+def db_stack(log=False, cache=None, retry=None, transactional=False,
+             pool=None, query_timeout=None, read_only=None):
+    """Build one wrapper equivalent to the requested decorator stack.
+
+    log           -- True for the shared query_logger, or a QueryLogWriter
+    cache         -- True for the shared query_cache, or a QueryCache
+    retry         -- dict of retry_on_failure options (True for defaults)
+    transactional -- run func inside a transaction (savepoint if nested)
+    pool          -- ConnectionPool to draw from (default_pool), or a
+                     ConnectionRouter to route each call between its
+                     reader pool and writer
+    query_timeout -- seconds before running statements are interrupted
+    read_only     -- with a ConnectionRouter, as for with_db_connection:
+                     True/False fixes the route, None inspects the query
+
+    Only synchronous functions can be fused; stack the async-aware
+    decorators directly on coroutine functions.
+    """
+    writer = _log_queries.query_logger if log is True else (log or None)
+    if cache is True:
+        cache = _cache_query.query_cache
+    retry = {} if retry is True else retry
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            raise TypeError("db_stack only fuses synchronous functions")
+
+        get_query = _locator(func, "query")
+        if isinstance(pool, ConnectionRouter):
+            def pick(args, kwargs):
+                return pool.route(get_query(args, kwargs), read_only)
+        else:
+            active_pool = pool or default_pool
+
+            def pick(args, kwargs):
+                return active_pool
+
+        if writer is None and cache is None and retry is None \
+                and not transactional and query_timeout is None:
+            @functools.wraps(func)
+            def connection_only(*args, **kwargs):
+                active = pick(args, kwargs)
+                conn = active.acquire()
+                try:
+                    return func(conn, *args, **kwargs)
+                finally:
+                    active.release(conn)
+            return connection_only
+
+        name = func.__qualname__
+        get_params = _locator(func, "params")
+        stats = _retry.RetryStats()
+        backoff = None
+        if retry is not None:
+            backoff = functools.partial(
+                _retry._backoff, retries=retry.get("retries", 3),
+                delay=retry.get("delay", 2),
+                max_delay=retry.get("max_delay", 30),
+                deadline=retry.get("deadline"),
+                retry_if=retry.get("retry_if", _retry.is_transient))
+
+        def run(conn, args, kwargs):
+            # transactional -> func
+            if transactional:
+                return _transactional._run_transaction(conn, func, args, kwargs)
+            return func(conn, *args, **kwargs)
+
+        def call(args, kwargs):
+            # retry -> with_db_connection -> run
+            if backoff is not None:
+                stats.add(calls=1)
+            start = time.monotonic()
+            attempt = 0
+            while True:
+                active = pick(args, kwargs)
+                conn = active.acquire()
+                try:
+                    if query_timeout is None:
+                        return run(conn, args, kwargs)
+                    with statement_timeout(conn, query_timeout):
+                        return run(conn, args, kwargs)
+                except Exception as e:
+                    if backoff is None:
+                        raise
+                    attempt += 1
+                    pause = backoff(e, attempt, start, stats)
+                    if pause is None:
+                        raise
+                finally:
+                    active.release(conn)
+                time.sleep(pause)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            query = get_query(args, kwargs)
+            if writer is not None:
+                timestamp = time.time()
+                began = time.perf_counter()
+            result = None
+            error = None
+            try:
+                if cache is None:
+                    result = call(args, kwargs)
+                else:
+                    key = _cache_query.cache_key(query, get_params(args, kwargs))
+                    result, _ = cache.get_or_load(
+                        key, lambda: call(args, kwargs),
+                        tables=_cache_query.read_tables(query))
+                return result
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                if writer is not None:
+                    writer.submit((
+                        timestamp, name, query, get_params(args, kwargs),
+                        time.perf_counter() - began,
+                        _log_queries._row_count(result), error,
+                    ))
+
+        if retry is not None:
+            wrapper.retry_stats = stats
+        if cache is not None:
+            wrapper.cache = cache
+        return wrapper
+    return decorator
+
@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+"""Load-shedding decorators for database-bound functions."""
+import time
+import asyncio
+import inspect
+import sqlite3
+import functools
+import threading
+from collections import deque
+
+try:
+    import mysql.connector
+except ImportError:
+    mysql = None
+
+from sqlite_utils import QueryTimeout
+
+
+class BulkheadFull(RuntimeError):
+    """A call was rejected: the wait queue was full or the wait timed out."""
+
+
+class _Waiter:
+    """A queued caller; release() hands its slot over by calling wake()."""
+    __slots__ = ("event", "loop", "future", "granted")
+
+    def __init__(self, event=None, loop=None, future=None):
+        self.event = event
+        self.loop = loop
+        self.future = future
+        self.granted = False
+
+    def wake(self):
+        if self.event is not None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class Bulkhead:
+    """Cap the calls in flight against one resource.
+
+    Up to max_concurrent calls run at once; up to max_queue more wait in
+    FIFO order for at most queue_timeout seconds (None waits forever).
+    Anything beyond that is rejected with BulkheadFull. Threads and asyncio
+    tasks share the same slots, so the limit holds across both paths.
+    """
+
+    def __init__(self, name="users.db", max_concurrent=4, max_queue=16,
+                 queue_timeout=1.0):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._waiters = deque()
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.peak_queue = 0
+        self.wait_time = 0.0
+
+    def _enter_or_queue(self, waiter):
+        """Take a free slot (returning None) or queue waiter; lock held."""
+        if self.in_flight < self.max_concurrent and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return None
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise BulkheadFull(
+                f"Bulkhead {self.name!r} full: {self.in_flight} running, "
+                f"{len(self._waiters)} queued")
+        self._waiters.append(waiter)
+        self.peak_queue = max(self.peak_queue, len(self._waiters))
+        return waiter
+
+    def _abandon(self, waiter, waited):
+        """Drop a waiter that stopped waiting; True if it got a slot anyway."""
+        with self._lock:
+            self.wait_time += waited
+            if waiter.granted:
+                self.admitted += 1
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def _timed_out(self):
+        with self._lock:
+            self.timed_out += 1
+        return BulkheadFull(
+            f"Bulkhead {self.name!r}: no slot within {self.queue_timeout}s")
+
+    def acquire(self):
+        """Block until a slot is free; raise BulkheadFull when shed."""
+        with self._lock:
+            waiter = self._enter_or_queue(_Waiter(event=threading.Event()))
+        if waiter is None:
+            return
+        start = time.monotonic()
+        waiter.event.wait(self.queue_timeout)
+        if not self._abandon(waiter, time.monotonic() - start):
+            raise self._timed_out()
+
+    async def acquire_async(self):
+        """acquire() for coroutines; waiting never blocks the event loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            waiter = self._enter_or_queue(
+                _Waiter(loop=loop, future=loop.create_future()))
+        if waiter is None:
+            return
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future),
+                                   self.queue_timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            if self._abandon(waiter, time.monotonic() - start):
+                self.release()
+            raise
+        if not self._abandon(waiter, time.monotonic() - start):
+            raise self._timed_out()
+
+    def release(self):
+        """Free a slot, handing it straight to the oldest waiter if any."""
+        with self._lock:
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                waiter.wake()
+                return
+            self.in_flight -= 1
+
+    def snapshot(self):
+        """Return a snapshot of the bulkhead counters."""
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "queued": len(self._waiters),
+                "peak_queue": self.peak_queue,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "wait_time": round(self.wait_time, 6),
+            }
+
+
+# One bulkhead per resource name, shared by every decorated function
+bulkheads = {}
+_bulkheads_lock = threading.Lock()
+
+
+def get_bulkhead(name, **options):
+    """Return the bulkhead for name, creating it with options on first use."""
+    with _bulkheads_lock:
+        if name not in bulkheads:
+            bulkheads[name] = Bulkhead(name, **options)
+        return bulkheads[name]
+
+
+def bulkhead(func=None, *, name="users.db", **options):
+    """Decorator limiting concurrent calls against resource `name`.
+
+    Options (max_concurrent, max_queue, queue_timeout) apply when the
+    named bulkhead is first created. Place it above with_db_connection so
+    queued callers do not hold a connection while they wait. Metrics are
+    available as wrapper.bulkhead.snapshot().
+    """
+    def decorator(func):
+        limiter = get_bulkhead(name, **options)
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                await limiter.acquire_async()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    limiter.release()
+            async_wrapper.bulkhead = limiter
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            limiter.acquire()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                limiter.release()
+        wrapper.bulkhead = limiter
+        return wrapper
+
+    if func is not None:
+        return decorator(func)
+    return decorator
+
+
+class CircuitOpen(RuntimeError):
+    """A call was refused because the target's circuit is open."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# sqlite errors meaning the database itself is unavailable or overloaded;
+# other OperationalErrors (syntax, missing table) are the caller's fault
+OUTAGE_MESSAGES = (
+    "database is locked",
+    "database table is locked",
+    "unable to open database",
+    "disk i/o error",
+    "database disk image is malformed",
+)
+
+
+def is_outage(exc):
+    """Return True for errors that suggest the backend is down or saturated."""
+    if isinstance(exc, (QueryTimeout, ConnectionError, TimeoutError)):
+        return True
+    if isinstance(exc, sqlite3.OperationalError):
+        message = str(exc).lower()
+        return any(text in message for text in OUTAGE_MESSAGES)
+    if mysql is not None and isinstance(
+            exc, (mysql.connector.InterfaceError,
+                  mysql.connector.OperationalError)):
+        return True
+    return False
+
+
+class CircuitBreaker:
+    """Fail fast while a target keeps failing.
+
+    closed    -- calls pass; the last `window` outcomes are kept and the
+                 circuit opens once at least min_calls were seen and the
+                 share of failures reaches failure_rate
+    open      -- calls raise CircuitOpen immediately for reset_timeout s
+    half_open -- up to half_open_calls probes pass; all succeeding closes
+                 the circuit, any failing reopens it
+
+    Only exceptions matching failure_if count as failures; others (and
+    returns) count as successes, since they show the target answered.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name="users.db", failure_rate=0.5, window=20,
+                 min_calls=5, reset_timeout=10.0, half_open_calls=1,
+                 failure_if=is_outage):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.failure_if = failure_if
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_successes = 0
+        self.state = self.CLOSED
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+        self.transitions = {}
+        self.history = deque(maxlen=50)
+
+    def _transition(self, state):
+        """Move to state; lock held."""
+        key = f"{self.state}->{state}"
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+        self.history.append((time.time(), self.state, state))
+        print(f"[WARNING] Circuit {self.name!r} {key}")
+        self.state = state
+        self._probes = 0
+        self._probe_successes = 0
+        if state == self.OPEN:
+            self._opened_at = time.monotonic()
+        elif state == self.CLOSED:
+            self._outcomes.clear()
+
+    def before_call(self):
+        """Admit a call or raise CircuitOpen; return True for a probe."""
+        with self._lock:
+            if self.state == self.OPEN:
+                waited = time.monotonic() - self._opened_at
+                if waited < self.reset_timeout:
+                    self.rejected += 1
+                    raise CircuitOpen(
+                        f"Circuit {self.name!r} is open",
+                        self.reset_timeout - waited)
+                self._transition(self.HALF_OPEN)
+            probe = self.state == self.HALF_OPEN
+            if probe:
+                if self._probes >= self.half_open_calls:
+                    self.rejected += 1
+                    raise CircuitOpen(
+                        f"Circuit {self.name!r} is half-open", 0.0)
+                self._probes += 1
+            self.calls += 1
+            return probe
+
+    def after_call(self, probe, error=None):
+        """Record the outcome of a call admitted by before_call()."""
+        failed = error is not None and self.failure_if(error)
+        with self._lock:
+            if failed:
+                self.failures += 1
+            if probe:
+                if self.state != self.HALF_OPEN:
+                    return
+                if failed:
+                    self._transition(self.OPEN)
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_calls:
+                    self._transition(self.CLOSED)
+                return
+            if self.state != self.CLOSED:
+                # Started before the circuit opened; too late to matter
+                return
+            self._outcomes.append(failed)
+            if len(self._outcomes) >= self.min_calls and \
+                    sum(self._outcomes) >= self.failure_rate * len(self._outcomes):
+                self._transition(self.OPEN)
+
+    def abandon(self, probe):
+        """Forget a call that was cancelled rather than finished."""
+        with self._lock:
+            if probe and self.state == self.HALF_OPEN:
+                self._probes -= 1
+
+    def reset(self):
+        """Force the circuit closed."""
+        with self._lock:
+            if self.state != self.CLOSED:
+                self._transition(self.CLOSED)
+
+    def snapshot(self):
+        """Return the current state and counters."""
+        with self._lock:
+            seen = len(self._outcomes)
+            return {
+                "state": self.state,
+                "failure_rate": round(sum(self._outcomes) / seen, 3) if seen else 0.0,
+                "calls": self.calls,
+                "failures": self.failures,
+                "rejected": self.rejected,
+                "transitions": dict(self.transitions),
+            }
+
+
+# One breaker per target name, shared by every decorated function
+breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name, **options):
+    """Return the breaker for name, creating it with options on first use."""
+    with _breakers_lock:
+        if name not in breakers:
+            breakers[name] = CircuitBreaker(name, **options)
+        return breakers[name]
+
+
+def circuit_breaker(func=None, *, name="users.db", **options):
+    """Decorator failing fast with CircuitOpen while target `name` is down.
+
+    Options (failure_rate, window, min_calls, reset_timeout,
+    half_open_calls, failure_if) apply when the named breaker is first
+    created. Place it above retry_on_failure so a whole retried call
+    counts once and an open circuit skips the retries entirely. State is
+    available as wrapper.circuit_breaker.snapshot().
+    """
+    def decorator(func):
+        breaker = get_breaker(name, **options)
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                probe = breaker.before_call()
+                try:
+                    result = await func(*args, **kwargs)
+                except Exception as e:
+                    breaker.after_call(probe, e)
+                    raise
+                except BaseException:
+                    breaker.abandon(probe)
+                    raise
+                breaker.after_call(probe)
+                return result
+            async_wrapper.circuit_breaker = breaker
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            probe = breaker.before_call()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                breaker.after_call(probe, e)
+                raise
+            except BaseException:
+                breaker.abandon(probe)
+                raise
+            breaker.after_call(probe)
+            return result
+        wrapper.circuit_breaker = breaker
+        return wrapper
+
+    if func is not None:
+        return decorator(func)
+    return decorator
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""Lightweight SQL inspection helpers shared by the decorator modules."""
+import re
+import functools
+
+
+# Identifier, optionally schema-qualified and quoted: main."users", [users]
+_NAME = r'(?:[\w"`\[\]]+\.)?([\w"`\[\]]+)'
+
+_NAME_RE = re.compile(_NAME)
+# String literals, identifiers (possibly quoted or qualified), punctuation
+_TOKEN_RE = re.compile(
+    r"'(?:[^']|'')*'"
+    r'|(?:(?:"[^"]*"|`[^`]*`|\[[^\]]*\]|[\w$]+)\.)*(?:"[^"]*"|`[^`]*`|\[[^\]]*\]|[\w$]+)'
+    r"|\S"
+)
+# Keywords that end a FROM list at the same nesting level
+_FROM_END = frozenset(("where", "group", "order", "limit", "having", "window",
+                       "union", "except", "intersect", "on", "using",
+                       "returning", "set", "values"))
+_WRITE_RE = re.compile(
+    r'^\s*(?:'
+    r'(?:INSERT|REPLACE)(?:\s+OR\s+\w+)?\s+INTO'
+    r'|UPDATE(?:\s+OR\s+\w+)?'
+    r'|DELETE\s+FROM'
+    r'|(?:DROP|ALTER)\s+TABLE(?:\s+IF\s+EXISTS)?'
+    r')\s+' + _NAME,
+    re.IGNORECASE,
+)
+_WRITE_VERBS = ("INSERT", "REPLACE", "UPDATE", "DELETE", "DROP", "ALTER")
+_CTE_WRITE_RE = re.compile(r'\b(?:INSERT|REPLACE|UPDATE|DELETE)\b',
+                           re.IGNORECASE)
+
+# Quoted text is kept verbatim; everything else is case-folded. sqlite
+# reads "..." as a string when no column has that name, so double-quoted,
+# backquoted and bracketed tokens are kept as they are too
+_LITERAL_RE = re.compile(
+    r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|`(?:[^`]|``)*`|\[[^\]]*\])""")
+_COMMENT_RE = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_SPACE_RE = re.compile(r"\s+")
+_PUNCT_RE = re.compile(r"\s*([=<>!,()]+)\s*")
+
+# Tag used for statements whose tables could not be worked out
+ALL_TABLES = "*"
+
+
+def _clean(name):
+    return name.strip('"`[]').lower()
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize_sql(query):
+    """Canonical form of a statement for use in cache and stats keys.
+
+    Comments are dropped, whitespace is collapsed and everything outside
+    quoted text ('...', "...", `...`, [...]) is lower-cased, so cosmetic
+    differences map to the same text. Memoised per distinct query string.
+    """
+    parts = _LITERAL_RE.split(query)
+    for i in range(0, len(parts), 2):
+        text = _COMMENT_RE.sub(" ", parts[i]).lower()
+        text = _SPACE_RE.sub(" ", text)
+        parts[i] = _PUNCT_RE.sub(r"\1", text)
+    return "".join(parts).strip().rstrip(";").rstrip()
+
+
+@functools.lru_cache(maxsize=1024)
+def read_tables(query):
+    """Return the tables a SELECT reads from, or {ALL_TABLES} if unknown."""
+    if not query:
+        return frozenset((ALL_TABLES,))
+    tables = set()
+    depth = 0
+    # Nesting levels currently inside a FROM list, e.g. FROM a, b JOIN c
+    from_depths = set()
+    expect_name = False
+    for token in _TOKEN_RE.findall(_COMMENT_RE.sub(" ", query)):
+        word = token.lower()
+        if token == "(":
+            # A subquery or table function: what follows is not a table name
+            depth += 1
+            expect_name = False
+        elif token == ")":
+            from_depths.discard(depth)
+            depth -= 1
+        elif word in ("from", "join"):
+            from_depths.add(depth)
+            expect_name = True
+        elif depth in from_depths and token == ",":
+            expect_name = True
+        elif depth in from_depths and word in _FROM_END:
+            from_depths.discard(depth)
+            expect_name = False
+        elif expect_name:
+            expect_name = False
+            if token[0] != "'":
+                match = _NAME_RE.fullmatch(token)
+                if match:
+                    tables.add(_clean(match.group(1)))
+    return frozenset(tables) or frozenset((ALL_TABLES,))
+
+
+def write_tables(statement):
+    """Return the tables a statement modifies.
+
+    Empty for reads and transaction control; {ALL_TABLES} for writes whose
+    target could not be parsed.
+    """
+    match = _WRITE_RE.match(statement)
+    if match:
+        return frozenset((_clean(match.group(1)),))
+    verb = statement.lstrip()[:7].upper()
+    if verb.startswith(_WRITE_VERBS) or (
+            verb.startswith("WITH") and _CTE_WRITE_RE.search(statement)):
+        return frozenset((ALL_TABLES,))
+    return frozenset()
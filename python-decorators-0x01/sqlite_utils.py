@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""Named sqlite connection profiles applied as PRAGMAs on connect."""
+import os
+import re
+import time
+import sqlite3
+import functools
+import threading
+from urllib.parse import quote
+from contextlib import asynccontextmanager, contextmanager
+
+
+# busy_timeout is applied first so a journal_mode switch waits for locks.
+# journal_mode=WAL is persistent: it stays on the file once set.
+PROFILES = {
+    "default": {},
+    "balanced": {
+        "busy_timeout": 5000,
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16384,        # 16 MiB
+        "mmap_size": 64 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    },
+    "read-heavy": {
+        "busy_timeout": 5000,
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -65536,        # 64 MiB
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    },
+    "bulk-load": {
+        "busy_timeout": 10000,
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "cache_size": -262144,       # 256 MiB
+        "mmap_size": 0,
+        "temp_store": "MEMORY",
+    },
+}
+
+_ALLOWED = ("busy_timeout", "journal_mode", "synchronous", "cache_size",
+            "mmap_size", "temp_store")
+
+
+def _validate(pragmas):
+    for pragma, value in pragmas.items():
+        if pragma not in _ALLOWED:
+            raise ValueError(f"Unsupported PRAGMA in profile: {pragma}")
+        if not isinstance(value, int) and not str(value).isidentifier():
+            raise ValueError(f"Invalid value for PRAGMA {pragma}: {value!r}")
+
+
+def register_profile(name, pragmas):
+    """Add or replace a named profile after validating its PRAGMAs."""
+    _validate(pragmas)
+    PROFILES[name] = dict(pragmas)
+
+
+def profile_statements(profile):
+    """Return the PRAGMA statements for a profile name or dict, in order."""
+    if profile is None:
+        return []
+    if isinstance(profile, str):
+        pragmas = PROFILES[profile]
+    else:
+        pragmas = profile
+        _validate(pragmas)
+    return [f"PRAGMA {pragma}={pragmas[pragma]}"
+            for pragma in _ALLOWED if pragma in pragmas]
+
+
+def apply_profile(conn, profile):
+    """Apply a profile (by name or as a dict of PRAGMAs) to a connection."""
+    for statement in profile_statements(profile):
+        conn.execute(statement)
+    return conn
+
+
+def connect(database, profile=None, **kwargs):
+    """sqlite3.connect() followed by apply_profile()."""
+    conn = sqlite3.connect(database, **kwargs)
+    try:
+        apply_profile(conn, profile)
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+
+def connect_readonly(database, profile=None, **kwargs):
+    """Open database with mode=ro and apply the profile's read PRAGMAs.
+
+    journal_mode is skipped: it can only be changed by a writer, and WAL
+    (set by the writer) is what lets these connections read concurrently.
+    """
+    uri = f"file:{quote(os.path.abspath(database))}?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, **kwargs)
+    try:
+        for statement in profile_statements(profile):
+            if not statement.startswith("PRAGMA journal_mode"):
+                conn.execute(statement)
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+
+_READ_VERBS = ("SELECT", "VALUES", "EXPLAIN")
+_WRITE_WORDS = re.compile(
+    r"\b(INSERT|UPDATE|DELETE|REPLACE|UPSERT|CREATE|DROP|ALTER)\b", re.I)
+
+
+@functools.lru_cache(maxsize=1024)
+def is_read_only(sql):
+    """Return True if sql can safely run on a read-only connection."""
+    words = sql.lstrip(" \t\n(").split(None, 1)
+    verb = words[0].upper() if words else ""
+    if verb in _READ_VERBS:
+        return True
+    # WITH ... may front an INSERT/UPDATE/DELETE
+    return verb == "WITH" and not _WRITE_WORDS.search(sql)
+
+
+class SerialWriter:
+    """A single read-write connection shared by all threads, one at a time.
+
+    acquire() blocks while another thread holds the writer and nests within
+    a thread, like ConnectionPool. Only the outermost release() hands it on,
+    rolling back anything left uncommitted.
+    """
+
+    def __init__(self, database="users.db", profile=None, **connect_kwargs):
+        self.database = database
+        self.profile = profile
+        self.connect_kwargs = connect_kwargs
+        self._lock = threading.RLock()
+        self._conn = None
+        self._owner = None
+        self._depth = 0
+        self.acquired = 0
+        self.contended = 0
+        self.wait_time = 0.0
+
+    def open(self):
+        """Connect now if not connected yet (e.g. to switch the file to WAL)."""
+        with self._lock:
+            if self._conn is None:
+                self._conn = connect(self.database, self.profile,
+                                     check_same_thread=False,
+                                     **self.connect_kwargs)
+            return self._conn
+
+    def held(self):
+        """True when the calling thread currently holds the writer."""
+        return self._owner == threading.get_ident()
+
+    def acquire(self):
+        if not self._lock.acquire(blocking=False):
+            start = time.monotonic()
+            self._lock.acquire()
+            self.contended += 1
+            self.wait_time += time.monotonic() - start
+        try:
+            conn = self.open()
+        except BaseException:
+            self._lock.release()
+            raise
+        self._owner = threading.get_ident()
+        self._depth += 1
+        self.acquired += 1
+        return conn
+
+    def release(self, conn):
+        self._depth -= 1
+        if self._depth == 0:
+            self._owner = None
+            if conn.in_transaction:
+                conn.rollback()
+        self._lock.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self):
+        return {
+            "acquired": self.acquired,
+            "contended": self.contended,
+            "wait_time": round(self.wait_time, 6),
+        }
+
+
+# One SerialWriter per database path, shared by every caller in the process
+writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(database, profile=None):
+    """Return the shared SerialWriter for database, creating it on first use."""
+    key = os.path.abspath(database)
+    with _writers_lock:
+        if key not in writers:
+            writers[key] = SerialWriter(database, profile)
+        return writers[key]
+
+
+class QueryTimeout(sqlite3.OperationalError):
+    """A statement was interrupted for running past its query timeout."""
+
+
+# VM instructions between deadline checks; small enough to react within
+# about a millisecond, large enough not to show up in query latency
+PROGRESS_STEPS = 1000
+
+# id(conn) -> the _Deadline currently installed on that connection
+_deadlines = {}
+
+
+class _Deadline:
+    """Progress handler that aborts the running statement once past `at`."""
+    __slots__ = ("at", "timeout", "expired")
+
+    def __init__(self, timeout):
+        self.at = time.monotonic() + timeout
+        self.timeout = timeout
+        self.expired = False
+
+    def __call__(self):
+        if time.monotonic() >= self.at:
+            self.expired = True
+            return 1
+        return 0
+
+
+def _open_scope(conn, timeout):
+    """Return (deadline, outer) for a new timeout scope on conn.
+
+    A nested scope never extends its enclosing one: when the outer deadline
+    is sooner, it is returned as-is and nothing new is installed.
+    """
+    outer = _deadlines.get(id(conn))
+    deadline = _Deadline(timeout)
+    if outer is not None and outer.at <= deadline.at:
+        return outer, outer
+    _deadlines[id(conn)] = deadline
+    return deadline, outer
+
+
+def _close_scope(conn, deadline, outer):
+    """Restore whatever handler was installed before _open_scope()."""
+    if deadline is outer:
+        return None
+    if outer is None:
+        del _deadlines[id(conn)]
+        return None
+    _deadlines[id(conn)] = outer
+    return outer
+
+
+def _timed_out(error, deadline):
+    if deadline.expired and not isinstance(error, QueryTimeout):
+        return QueryTimeout(
+            f"Query exceeded its {deadline.timeout}s timeout and was interrupted")
+    return None
+
+
+@contextmanager
+def statement_timeout(conn, timeout):
+    """Interrupt statements on conn that run past timeout seconds.
+
+    The deadline covers the whole block, so a slow fetch loop is stopped as
+    well as a single slow statement. Interrupted statements surface as
+    QueryTimeout (an OperationalError). timeout=None disables the check.
+    """
+    if timeout is None:
+        yield conn
+        return
+    deadline, outer = _open_scope(conn, timeout)
+    if deadline is not outer:
+        conn.set_progress_handler(deadline, PROGRESS_STEPS)
+    try:
+        yield conn
+    except sqlite3.OperationalError as e:
+        error = _timed_out(e, deadline)
+        if error is not None:
+            raise error from e
+        raise
+    finally:
+        if deadline is not outer:
+            conn.set_progress_handler(
+                _close_scope(conn, deadline, outer), PROGRESS_STEPS)
+
+
+@asynccontextmanager
+async def async_statement_timeout(conn, timeout):
+    """statement_timeout() for aiosqlite connections."""
+    if timeout is None:
+        yield conn
+        return
+    deadline, outer = _open_scope(conn, timeout)
+    if deadline is not outer:
+        await conn.set_progress_handler(deadline, PROGRESS_STEPS)
+    try:
+        yield conn
+    except sqlite3.OperationalError as e:
+        error = _timed_out(e, deadline)
+        if error is not None:
+            raise error from e
+        raise
+    finally:
+        if deadline is not outer:
+            await conn.set_progress_handler(
+                _close_scope(conn, deadline, outer), PROGRESS_STEPS)
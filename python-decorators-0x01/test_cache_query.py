@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+import io
+import os
+import sqlite3
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+from cache_store import QueryCache
+from db_pool import ConnectionPool, with_db_connection
+
+_cache_query = __import__("4-cache_query")
+cache_query = _cache_query.cache_query
+cache_key = _cache_query.cache_key
+CacheWarmer = _cache_query.CacheWarmer
+
+
+class CacheKeyTest(unittest.TestCase):
+
+    def test_cosmetic_differences_share_a_key(self):
+        self.assertEqual(
+            cache_key("SELECT * FROM users WHERE id = ?", (1,)),
+            cache_key("select *\n from USERS where id=?;", [1]))
+
+    def test_params_differing_by_value_or_type_do_not_collide(self):
+        query = "SELECT * FROM users WHERE id = ?"
+        keys = {cache_key(query, params)
+                for params in ((1,), (2,), (1.0,), (True,), ("1",))}
+        self.assertEqual(len(keys), 5)
+        self.assertNotEqual(cache_key(query, {"id": 1}),
+                            cache_key(query, {"id": 2}))
+
+    def test_quoted_text_does_not_collide(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, "users.db")
+            conn = sqlite3.connect(path)
+            conn.executescript("""
+                CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT);
+                INSERT INTO users VALUES (1, 'Alice'), (2, 'alice');
+            """)
+            conn.close()
+            pool = ConnectionPool(path)
+
+            @with_db_connection(pool=pool)
+            @cache_query(maxsize=8)
+            def fetch(conn, query, params=()):
+                return conn.execute(query, params).fetchall()
+
+            try:
+                with redirect_stdout(io.StringIO()):
+                    self.assertEqual(fetch(
+                        query='SELECT id FROM users WHERE name = "Alice"'),
+                        [(1,)])
+                    self.assertEqual(fetch(
+                        query='SELECT id FROM users WHERE name = "alice"'),
+                        [(2,)])
+            finally:
+                pool.close_all()
+
+
+class CacheWarmerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = QueryCache(maxsize=8)
+        self.calls = []
+
+        @cache_query(cache=self.cache)
+        def fetch(query, params=()):
+            self.calls.append((query, params))
+            return [(query,)]
+
+        self.fetch = fetch
+        self.warmer = CacheWarmer(fetch, workers=2)
+        self.warmer.register("SELECT * FROM users")
+        self.warmer.register("SELECT * FROM posts")
+
+    def test_warm_skips_cached_keys(self):
+        with redirect_stdout(io.StringIO()):
+            self.fetch(query="SELECT * FROM users")
+            self.assertEqual(self.warmer.warm(), 1)
+            self.assertEqual(self.warmer.warm(), 0)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_warmer_loads_are_not_counted(self):
+        with redirect_stdout(io.StringIO()):
+            self.warmer.warm()
+            self.warmer.refresh()
+            self.fetch(query="SELECT * FROM posts")
+        self.assertEqual(self.cache.hot_keys(),
+                         [cache_key("SELECT * FROM posts", ())])
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
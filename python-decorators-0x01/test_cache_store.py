@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+import asyncio
+import io
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import textwrap
+import threading
+import time
+import unittest
+from contextlib import redirect_stdout
+
+from cache_store import ALL_TABLES, QueryCache, SQLiteBackend, estimate_size
+
+
+class BoundedCacheTest(unittest.TestCase):
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = QueryCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual([key in cache for key in "abc"], [True, False, True])
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_maxbytes_bounds_the_total_size(self):
+        rows = [(1, "x" * 100)]
+        cache = QueryCache(maxsize=None, maxbytes=estimate_size(rows) * 2)
+        for key in "abc":
+            cache.set(key, rows)
+        self.assertEqual([key in cache for key in "abc"], [False, True, True])
+        self.assertLessEqual(cache.stats()["bytes"], estimate_size(rows) * 2)
+        # A result bigger than the whole budget is never stored
+        cache.set("big", [(1, "x" * 10000)])
+        self.assertNotIn("big", cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_entries_expire_after_ttl(self):
+        cache = QueryCache(maxsize=8, ttl=0.05)
+        cache.set("default", 1)
+        cache.set("longer", 2, ttl=60)
+        time.sleep(0.1)
+        self.assertIsNone(cache.get("default"))
+        self.assertEqual(cache.get("longer"), 2)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+
+class CoalescedMissTest(unittest.TestCase):
+
+    def test_concurrent_misses_share_one_load(self):
+        cache = QueryCache(maxsize=8)
+        release = threading.Event()
+        calls = []
+
+        def loader():
+            calls.append(1)
+            release.wait(5)
+            return [("row",)]
+
+        results = []
+
+        def reader():
+            results.append(cache.get_or_load("key", loader, tables=("users",)))
+
+        threads = [threading.Thread(target=reader) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        # Let every reader reach the in-flight load before it finishes
+        while cache.coalesced < 7:
+            threading.Event().wait(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([value for value, _ in results], [[("row",)]] * 8)
+        self.assertEqual(sorted(hit for _, hit in results), [False] + [True] * 7)
+        self.assertIn("key", cache)
+
+    def test_loader_error_reaches_waiters_and_is_not_cached(self):
+        cache = QueryCache(maxsize=8)
+        started = threading.Event()
+        release = threading.Event()
+
+        def loader():
+            started.set()
+            release.wait(5)
+            raise ValueError("boom")
+
+        errors = []
+
+        def call():
+            try:
+                cache.get_or_load("key", loader)
+            except ValueError as e:
+                errors.append(e)
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait(5)
+        waiter = threading.Thread(target=call)
+        waiter.start()
+        while cache.coalesced < 1:
+            threading.Event().wait(0.001)
+        release.set()
+        leader.join()
+        waiter.join()
+
+        self.assertEqual(len(errors), 2)
+        self.assertNotIn("key", cache)
+
+    def test_counters_agree_with_reported_hits(self):
+        cache = QueryCache(maxsize=8)
+        release = threading.Event()
+        results = []
+
+        def loader():
+            release.wait(5)
+            return "value"
+
+        threads = [threading.Thread(target=lambda: results.append(
+            cache.get_or_load("key", loader))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        while cache.coalesced < 4:
+            threading.Event().wait(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        results.append(cache.get_or_load("key", loader))
+
+        reported = sum(hit for _, hit in results)
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]),
+                         (reported, len(results) - reported))
+        self.assertEqual(reported, 5)
+
+    def test_store_error_still_returns_the_loaded_value(self):
+        # Compact storage cannot pickle sqlite3.Row results
+        conn = sqlite3.connect(":memory:")
+        conn.row_factory = sqlite3.Row
+        rows = conn.execute("SELECT 1 AS id").fetchall()
+        conn.close()
+        cache = QueryCache(maxsize=8, compact=True)
+        started = threading.Event()
+        release = threading.Event()
+
+        def loader():
+            started.set()
+            release.wait(5)
+            return rows
+
+        results = []
+        with redirect_stdout(io.StringIO()):
+            leader = threading.Thread(target=lambda: results.append(
+                cache.get_or_load("key", loader)), daemon=True)
+            leader.start()
+            started.wait(5)
+            waiter = threading.Thread(target=lambda: results.append(
+                cache.get_or_load("key", loader)), daemon=True)
+            waiter.start()
+            while cache.coalesced < 1:
+                threading.Event().wait(0.001)
+            release.set()
+            leader.join(5)
+            waiter.join(5)
+
+        self.assertFalse(waiter.is_alive())
+        self.assertEqual(sorted(hit for _, hit in results), [False, True])
+        self.assertTrue(all(value is rows for value, _ in results))
+        self.assertNotIn("key", cache)
+
+
+class AsyncCoalescingTest(unittest.TestCase):
+
+    def test_loads_on_different_loops_do_not_share_futures(self):
+        cache = QueryCache(maxsize=8)
+        started = threading.Barrier(2, timeout=5)
+        results = []
+        errors = []
+
+        async def loader():
+            await asyncio.get_running_loop().run_in_executor(
+                None, started.wait)
+            return "value"
+
+        def run_loop():
+            try:
+                results.append(asyncio.run(cache.aget_or_load("key", loader)))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run_loop) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(results, [("value", False)] * 2)
+
+
+class StaleFlightTest(unittest.TestCase):
+
+    def _load_while_invalidating(self, tables):
+        cache = QueryCache(maxsize=8)
+        started = threading.Event()
+        release = threading.Event()
+
+        def loader():
+            started.set()
+            release.wait(5)
+            return "old"
+
+        results = []
+        thread = threading.Thread(target=lambda: results.append(
+            cache.get_or_load("key", loader, tables=("users",))))
+        thread.start()
+        started.wait(5)
+        cache.invalidate_tables(frozenset(tables))
+        release.set()
+        thread.join()
+        return cache, results
+
+    def test_invalidation_during_load_keeps_result_out_of_cache(self):
+        cache, results = self._load_while_invalidating({"users"})
+        # The caller still gets its value, but it is never stored
+        self.assertEqual(results, [("old", False)])
+        self.assertNotIn("key", cache)
+
+    def test_unrelated_invalidation_still_caches(self):
+        cache, results = self._load_while_invalidating({"posts"})
+        self.assertEqual(results, [("old", False)])
+        self.assertIn("key", cache)
+
+
+class CompactBackendTest(unittest.TestCase):
+
+    def test_round_trip_returns_private_copies(self):
+        cache = QueryCache(maxsize=8, compact=True)
+        rows = [(1, "alice", None, 1.5, b"x")]
+        cache.set("key", rows)
+        first = cache.get("key")
+        self.assertEqual(first, rows)
+        first.append("mutated")
+        self.assertEqual(cache.get("key"), rows)
+        self.assertGreaterEqual(cache.stats()["bytes_saved"], 0)
+
+
+class SQLiteBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.workdir.name, "cache.db")
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def test_entries_are_shared_between_processes(self):
+        script = textwrap.dedent(f"""
+            from cache_store import QueryCache, SQLiteBackend
+            cache = QueryCache(backend=SQLiteBackend({self.path!r}))
+            cache.set(("select 1", ()), [(1, "alice")], tables=("users",))
+        """)
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(
+            os.path.abspath(__file__)))
+        subprocess.run([sys.executable, "-c", script], env=env, check=True,
+                       timeout=30)
+        cache = QueryCache(backend=SQLiteBackend(self.path))
+        self.assertEqual(cache.get(("select 1", ())), [(1, "alice")])
+
+    def test_invalidation_drops_entries_reading_the_tables(self):
+        cache = QueryCache(backend=SQLiteBackend(self.path))
+        cache.set("users", 1, tables=("users",))
+        cache.set("posts", 2, tables=("posts",))
+        cache.set("unknown", 3, tables=(ALL_TABLES,))
+        cache.invalidate_tables({"users"})
+        self.assertEqual([key in cache for key in ("users", "posts", "unknown")],
+                         [False, True, False])
+
+    def test_entries_expire_after_ttl(self):
+        cache = QueryCache(ttl=0.05, backend=SQLiteBackend(self.path))
+        cache.set("key", "value")
+        self.assertEqual(cache.get("key"), "value")
+        time.sleep(0.1)
+        self.assertIsNone(cache.get("key"))
+        self.assertEqual(len(cache), 0)
+
+    def test_eviction_removes_oldest_entries_first(self):
+        backend = SQLiteBackend(self.path, maxsize=3)
+        cache = QueryCache(backend=backend)
+        for i in range(5):
+            cache.set(i, "x" * 100)
+            time.sleep(0.002)
+        self.assertEqual([i in cache for i in range(5)],
+                         [False, False, True, True, True])
+        self.assertEqual(backend.evictions, 2)
+
+        limit = backend.nbytes - 1
+        backend = SQLiteBackend(self.path, maxsize=None, maxbytes=limit)
+        QueryCache(backend=backend).set(5, "y")
+        self.assertNotIn(2, cache)
+        self.assertLessEqual(backend.nbytes, limit)
+
+    def test_running_totals_match_the_table(self):
+        backend = SQLiteBackend(self.path, maxsize=4)
+        cache = QueryCache(backend=backend)
+        for i in range(10):
+            cache.set(i, [i] * i, tables=("users",))
+        cache.invalidate(9)
+        cache.invalidate_tables({"posts"})
+        conn = sqlite3.connect(self.path)
+        try:
+            expected = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries"
+            ).fetchone()
+        finally:
+            conn.close()
+        self.assertEqual((len(backend), backend.nbytes), expected)
+        self.assertEqual(len(backend), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import textwrap
+import threading
+import unittest
+
+from db_pool import ConnectionPool, ConnectionRouter
+from sqlite_utils import get_writer
+
+try:
+    import aiosqlite
+except ImportError:
+    aiosqlite = None
+
+
+class _RacingPool(ConnectionPool):
+    """Runs a prune from another thread right after each liveness check."""
+
+    def _usable(self, slot, now):
+        usable = super()._usable(slot, now)
+        slot.last_used = now - 2 * self.idle_timeout
+        pruner = threading.Thread(target=self.prune_idle)
+        pruner.start()
+        pruner.join()
+        return usable
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.workdir.name, "users.db")
+        self.pool = ConnectionPool(self.path)
+
+    def tearDown(self):
+        self.pool.close_all()
+        self.workdir.cleanup()
+
+    def test_prune_never_closes_a_reused_connection(self):
+        pool = _RacingPool(self.path, idle_timeout=5.0)
+        with pool.connection() as conn:
+            conn.execute("SELECT 1")
+        try:
+            with pool.connection() as conn:
+                conn.execute("SELECT 1")
+        except sqlite3.ProgrammingError as e:
+            self.fail(f"got a closed connection: {e}")
+        finally:
+            pool.close_all()
+
+    def test_nested_acquire_shares_one_connection(self):
+        with self.pool.connection() as outer:
+            with self.pool.connection() as inner:
+                self.assertIs(inner, outer)
+            outer.execute("SELECT 1")
+
+
+@unittest.skipIf(aiosqlite is None, "aiosqlite is not installed")
+class AsyncConnectionPoolTest(unittest.TestCase):
+
+    def test_script_using_async_decorator_exits(self):
+        # aiosqlite threads are non-daemon; leftover idle connections used to
+        # keep the interpreter from exiting after asyncio.run() returned
+        script = textwrap.dedent("""
+            import asyncio
+            from db_pool import with_db_connection
+
+            @with_db_connection
+            async def ping(conn):
+                async with conn.execute("SELECT 1") as cursor:
+                    return await cursor.fetchone()
+
+            async def main():
+                await asyncio.gather(*(ping() for _ in range(6)))
+
+            asyncio.run(main())
+            asyncio.run(main())
+        """)
+        with tempfile.TemporaryDirectory() as workdir:
+            env = dict(os.environ, PYTHONPATH=os.path.dirname(
+                os.path.abspath(__file__)))
+            result = subprocess.run([sys.executable, "-c", script],
+                                    cwd=workdir, env=env, timeout=30)
+        self.assertEqual(result.returncode, 0)
+
+
+class ConnectionRouterTest(unittest.TestCase):
+
+    def test_routers_share_the_process_wide_writer(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, "users.db")
+            first, second = ConnectionRouter(path), ConnectionRouter(path)
+            try:
+                self.assertIs(first.writer, second.writer)
+                self.assertIs(first.writer, get_writer(path))
+            finally:
+                first.close_all()
+                second.close_all()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+import io
+import os
+import sqlite3
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+from db_pool import ConnectionPool, ConnectionRouter
+from db_stack import db_stack
+
+
+class DbStackTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.workdir.name, "users.db")
+        conn = sqlite3.connect(self.path)
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, email TEXT)")
+        conn.commit()
+        conn.close()
+        self.pool = ConnectionPool(self.path)
+
+    def tearDown(self):
+        self.pool.close_all()
+        self.workdir.cleanup()
+
+    def test_retry_warns_and_counts_like_retry_on_failure(self):
+        attempts = []
+
+        @db_stack(retry={"retries": 3, "delay": 0}, pool=self.pool)
+        def flaky(conn):
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise sqlite3.OperationalError("database is locked")
+            return "ok"
+
+        out = io.StringIO()
+        with redirect_stdout(out):
+            self.assertEqual(flaky(), "ok")
+        self.assertEqual(out.getvalue().count("[WARNING] Attempt"), 2)
+        stats = flaky.retry_stats.snapshot()
+        self.assertEqual((stats["calls"], stats["retries"], stats["failures"]),
+                         (1, 2, 0))
+
+    def test_transactional_rolls_back_on_error(self):
+        @db_stack(transactional=True, pool=self.pool)
+        def insert(conn, fail):
+            conn.execute("INSERT INTO users VALUES (1, 'a')")
+            if fail:
+                raise ValueError("fail")
+
+        with redirect_stdout(io.StringIO()), self.assertRaises(ValueError):
+            insert(True)
+        insert(False)
+        conn = sqlite3.connect(self.path)
+        try:
+            self.assertEqual(conn.execute("SELECT email FROM users").fetchall(),
+                             [("a",)])
+        finally:
+            conn.close()
+
+    def test_router_routes_each_call(self):
+        router = ConnectionRouter(self.path)
+
+        @db_stack(pool=router)
+        def execute(conn, query, params=()):
+            rows = conn.execute(query, params).fetchall()
+            conn.commit()
+            return rows
+
+        @db_stack(pool=router, retry=True, read_only=True)
+        def count(conn):
+            return conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+        try:
+            execute("INSERT INTO users VALUES (1, 'a')")
+            self.assertEqual(execute("SELECT email FROM users"), [("a",)])
+            self.assertEqual(count(), 1)
+            stats = router.stats()
+            self.assertEqual((stats["reads"], stats["writes"]), (2, 1))
+        finally:
+            router.close_all()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from db_pool import ConnectionPool
+
+_log_queries = __import__("0-log_queries")
+QueryLogWriter = _log_queries.QueryLogWriter
+QueryStats = _log_queries.QueryStats
+log_queries = _log_queries.log_queries
+
+
+def _record(query="SELECT 1", duration=0.001, rows=1, error=None):
+    return (time.time(), "fetch", query, (), duration, rows, error)
+
+
+class QueryLogWriterTest(unittest.TestCase):
+
+    def make_writer(self, **options):
+        self.stream = io.StringIO()
+        # A long interval so the test flushes explicitly
+        writer = QueryLogWriter(stream=self.stream, flush_interval=60,
+                                **options)
+        self.addCleanup(writer.close)
+        return writer
+
+    def lines(self):
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_decorated_call_writes_one_structured_line(self):
+        writer = self.make_writer()
+
+        @log_queries(writer=writer)
+        def fetch(query):
+            return [(1,), (2,)]
+
+        fetch(query="SELECT * FROM users")
+        writer.flush()
+        (line,) = self.lines()
+        self.assertEqual(
+            (line["event"], line["func"], line["query"], line["rows"]),
+            ("sql_query", fetch.__qualname__, "SELECT * FROM users", 2))
+        self.assertNotIn("error", line)
+
+    def test_errors_are_logged_and_reraised(self):
+        writer = self.make_writer()
+
+        @log_queries(writer=writer)
+        def fetch(query):
+            raise ValueError("boom")
+
+        with self.assertRaises(ValueError):
+            fetch(query="SELECT 1")
+        writer.flush()
+        self.assertEqual(self.lines()[0]["error"], "ValueError")
+
+    def test_sampling_drops_lines_but_not_stats(self):
+        writer = self.make_writer(sample_rate=0.0)
+        for _ in range(10):
+            writer.submit(_record())
+        writer.flush()
+        self.assertEqual(self.lines(), [])
+        self.assertEqual((writer.stats()["written"], writer.stats()["sampled_out"]),
+                         (0, 10))
+        self.assertEqual(writer.stats_collector.snapshot()["select 1"]["count"], 10)
+
+    def test_rate_limit_caps_lines_per_second(self):
+        writer = self.make_writer(rate_limit=3)
+        for _ in range(10):
+            writer.submit(_record())
+        writer.flush()
+        self.assertEqual(len(self.lines()), 3)
+        self.assertEqual(writer.stats()["rate_limited"], 7)
+
+    def test_full_buffer_drops_oldest_records(self):
+        writer = self.make_writer(max_pending=2)
+        for i in range(5):
+            writer.submit(_record(query=f"SELECT {i}"))
+        writer.flush()
+        self.assertEqual([line["query"] for line in self.lines()],
+                         ["SELECT 3", "SELECT 4"])
+
+
+class QueryStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.workdir.name, "users.db")
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, email TEXT)")
+        conn.close()
+        self.pool = ConnectionPool(path)
+        self.stats = QueryStats(slow_threshold=0.05, pool=self.pool)
+
+    def tearDown(self):
+        self.pool.close_all()
+        self.workdir.cleanup()
+
+    def test_histogram_and_percentiles_per_normalised_query(self):
+        # 90 fast calls (0.2ms) and 10 slower ones (7ms), in two spellings
+        for i in range(100):
+            query = "SELECT * FROM users" if i % 2 else "select *  from USERS"
+            duration = 0.007 if i < 10 else 0.0002
+            self.stats.record(time.time(), query, (), duration, 3,
+                              "ValueError" if i == 0 else None)
+        (summary,) = self.stats.snapshot().values()
+        self.assertEqual((summary["count"], summary["errors"], summary["rows"]),
+                         (100, 1, 300))
+        self.assertEqual(summary["histogram"]["0.25"], 90)
+        self.assertEqual(summary["histogram"]["10"], 10)
+        self.assertEqual(summary["p50_ms"], 0.25)
+        self.assertEqual(summary["p99_ms"], 7.0)
+        self.assertEqual(summary["max_ms"], 7.0)
+
+    def test_slow_queries_capture_the_plan_once(self):
+        query = "SELECT * FROM users WHERE id = ?"
+        for _ in range(2):
+            self.stats.record(time.time(), query, (1,), 0.2, 0, None)
+        self.stats.record(time.time(), query, (1,), 0.001, 0, None)
+        slow = self.stats.slow_queries()
+        self.assertEqual(len(slow), 2)
+        self.assertEqual(slow[0]["duration_ms"], 200.0)
+        self.assertTrue(any("users" in step.lower() for step in slow[0]["plan"]))
+        self.assertIs(slow[0]["plan"], slow[1]["plan"])
+
+    def test_failed_explain_is_recorded(self):
+        self.stats.record(time.time(), "SELECT * FROM missing", (), 0.2, 0,
+                          "OperationalError")
+        (capture,) = self.stats.slow_queries()
+        self.assertIn("EXPLAIN failed", capture["plan"][0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+import asyncio
+import sqlite3
+import threading
+import time
+import unittest
+
+from resilience import Bulkhead, BulkheadFull, CircuitBreaker, CircuitOpen
+
+
+class BulkheadTest(unittest.TestCase):
+
+    def test_release_hands_slot_to_oldest_waiter(self):
+        bulkhead = Bulkhead("test", max_concurrent=1, max_queue=4,
+                            queue_timeout=5)
+        bulkhead.acquire()
+        order = []
+
+        def waiter(name):
+            bulkhead.acquire()
+            order.append(name)
+            bulkhead.release()
+
+        threads = []
+        for name in ("first", "second"):
+            thread = threading.Thread(target=waiter, args=(name,))
+            thread.start()
+            threads.append(thread)
+            while bulkhead.snapshot()["queued"] < len(threads):
+                time.sleep(0.001)
+        bulkhead.release()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(order, ["first", "second"])
+        stats = bulkhead.snapshot()
+        self.assertEqual((stats["in_flight"], stats["queued"]), (0, 0))
+        self.assertEqual(stats["admitted"], 3)
+
+    def test_wait_times_out(self):
+        bulkhead = Bulkhead("test", max_concurrent=1, max_queue=4,
+                            queue_timeout=0.05)
+        bulkhead.acquire()
+        with self.assertRaises(BulkheadFull):
+            bulkhead.acquire()
+        stats = bulkhead.snapshot()
+        self.assertEqual((stats["timed_out"], stats["queued"]), (1, 0))
+        bulkhead.release()
+        # The slot is free again after the timed-out waiter left
+        bulkhead.acquire()
+        bulkhead.release()
+
+    def test_full_queue_rejects_immediately(self):
+        bulkhead = Bulkhead("test", max_concurrent=1, max_queue=0)
+        bulkhead.acquire()
+        with self.assertRaises(BulkheadFull):
+            bulkhead.acquire()
+        self.assertEqual(bulkhead.snapshot()["rejected"], 1)
+
+    def test_async_waiter_gets_slot_from_thread_release(self):
+        bulkhead = Bulkhead("test", max_concurrent=1, max_queue=4,
+                            queue_timeout=5)
+        bulkhead.acquire()
+
+        async def main():
+            task = asyncio.ensure_future(bulkhead.acquire_async())
+            while bulkhead.snapshot()["queued"] < 1:
+                await asyncio.sleep(0.001)
+            threading.Thread(target=bulkhead.release).start()
+            await task
+            bulkhead.release()
+
+        asyncio.run(main())
+        self.assertEqual(bulkhead.snapshot()["in_flight"], 0)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def test_opens_then_probes_and_closes(self):
+        breaker = CircuitBreaker("test", min_calls=2, window=4,
+                                 reset_timeout=0.05)
+        locked = sqlite3.OperationalError("database is locked")
+        for _ in range(2):
+            probe = breaker.before_call()
+            breaker.after_call(probe, locked)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpen):
+            breaker.before_call()
+
+        time.sleep(0.06)
+        probe = breaker.before_call()
+        self.assertTrue(probe)
+        breaker.after_call(probe)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_caller_errors_do_not_count(self):
+        breaker = CircuitBreaker("test", min_calls=2, window=4)
+        for _ in range(4):
+            probe = breaker.before_call()
+            breaker.after_call(probe, sqlite3.OperationalError("no such table: x"))
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+if __name__ == "__main__":
+    unittest.main()
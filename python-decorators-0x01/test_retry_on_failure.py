@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+import asyncio
+import io
+import sqlite3
+import unittest
+from unittest import mock
+
+from sqlite_utils import QueryTimeout
+
+_retry = __import__("3-retry_on_failure")
+retry_on_failure = _retry.retry_on_failure
+is_transient = _retry.is_transient
+
+LOCKED = sqlite3.OperationalError("database is locked")
+
+
+def _failing(errors, result="ok"):
+    """A function raising errors in turn, then returning result."""
+    errors = list(errors)
+    calls = []
+
+    def func():
+        calls.append(1)
+        if errors:
+            raise errors.pop(0)
+        return result
+    return func, calls
+
+
+class RetryTest(unittest.TestCase):
+
+    def setUp(self):
+        # Keep the retry warnings out of the test output
+        patcher = mock.patch("sys.stdout", io.StringIO())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_only_transient_errors_are_retried(self):
+        self.assertTrue(is_transient(LOCKED))
+        self.assertFalse(is_transient(sqlite3.OperationalError("no such table: x")))
+        self.assertFalse(is_transient(QueryTimeout("query timed out")))
+        self.assertFalse(is_transient(ValueError("locked")))
+
+        func, calls = _failing([sqlite3.OperationalError("no such table: x")])
+        with self.assertRaises(sqlite3.OperationalError):
+            retry_on_failure(retries=3, delay=0)(func)()
+        self.assertEqual(len(calls), 1)
+
+    def test_backoff_is_full_jitter_capped_by_max_delay(self):
+        func, calls = _failing([LOCKED] * 4)
+        wrapped = retry_on_failure(retries=5, delay=1, max_delay=3)(func)
+        with mock.patch.object(_retry.random, "uniform",
+                               side_effect=lambda low, high: 0) as uniform, \
+                mock.patch.object(_retry.time, "sleep"):
+            self.assertEqual(wrapped(), "ok")
+        self.assertEqual([c.args for c in uniform.call_args_list],
+                         [(0, 1), (0, 2), (0, 3), (0, 3)])
+        stats = wrapped.retry_stats.snapshot()
+        self.assertEqual((stats["calls"], stats["retries"], stats["failures"]),
+                         (1, 4, 0))
+
+    def test_gives_up_after_retries_attempts(self):
+        func, calls = _failing([LOCKED] * 5)
+        wrapped = retry_on_failure(retries=3, delay=0)(func)
+        with self.assertRaises(sqlite3.OperationalError):
+            wrapped()
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(wrapped.retry_stats.snapshot()["failures"], 1)
+
+    def test_no_retry_starts_past_the_deadline(self):
+        func, calls = _failing([LOCKED] * 5)
+        wrapped = retry_on_failure(retries=10, delay=5, deadline=1)(func)
+        with mock.patch.object(_retry.random, "uniform", return_value=2), \
+                mock.patch.object(_retry.time, "sleep") as sleep:
+            with self.assertRaises(sqlite3.OperationalError):
+                wrapped()
+        self.assertEqual(len(calls), 1)
+        sleep.assert_not_called()
+        self.assertEqual(wrapped.retry_stats.snapshot()["deadline_exceeded"], 1)
+
+    def test_coroutines_are_retried(self):
+        errors = [LOCKED]
+
+        @retry_on_failure(retries=2, delay=0)
+        async def fetch():
+            if errors:
+                raise errors.pop()
+            return "ok"
+
+        self.assertEqual(asyncio.run(fetch()), "ok")
+        self.assertEqual(fetch.retry_stats.snapshot()["retries"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
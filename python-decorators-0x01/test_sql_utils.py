@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from db_pool import ConnectionPool, with_db_connection
+from sql_utils import ALL_TABLES, normalize_sql, read_tables
+
+_transactional = __import__("2-transactional")
+_cache_query = __import__("4-cache_query")
+
+
+class ReadTablesTest(unittest.TestCase):
+
+    def test_comma_join_tags_every_table(self):
+        self.assertEqual(
+            read_tables("SELECT * FROM users u, posts p WHERE u.id = p.uid"),
+            {"users", "posts"})
+
+    def test_joins_subqueries_and_quoting(self):
+        self.assertEqual(read_tables(
+            'SELECT * FROM (SELECT id FROM users) s, main."Posts" '
+            "JOIN [tags] t ON t.pid = s.id WHERE s.id IN (1, 2)"),
+            {"users", "posts", "tags"})
+
+    def test_literals_are_not_tables(self):
+        self.assertEqual(
+            read_tables("SELECT * FROM users WHERE name = 'a, from b'"),
+            {"users"})
+
+    def test_unknown_falls_back_to_all_tables(self):
+        self.assertEqual(read_tables("SELECT 1"), {ALL_TABLES})
+
+
+class NormalizeSqlTest(unittest.TestCase):
+
+    def test_whitespace_case_and_comments_collapse(self):
+        self.assertEqual(
+            normalize_sql("SELECT *\n  FROM Users -- all of them\n WHERE id = ?;"),
+            normalize_sql("select * from users where id=?"))
+
+    def test_quoted_text_is_kept_verbatim(self):
+        for quoted in ("'Alice'", '"Alice"', "`Alice`", "[Alice]"):
+            self.assertIn(quoted, normalize_sql(f"SELECT {quoted} FROM users"))
+        self.assertNotEqual(
+            normalize_sql('SELECT id FROM users WHERE name = "Alice"'),
+            normalize_sql('SELECT id FROM users WHERE name = "alice"'))
+
+
+class CommaJoinInvalidationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.workdir.name, "users.db")
+        conn = sqlite3.connect(path)
+        conn.executescript("""
+            CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT);
+            CREATE TABLE posts (id INTEGER PRIMARY KEY, uid INTEGER, title TEXT);
+            INSERT INTO users VALUES (1, 'alice');
+            INSERT INTO posts VALUES (1, 1, 't1');
+        """)
+        conn.commit()
+        conn.close()
+        self.pool = ConnectionPool(path)
+
+    def tearDown(self):
+        self.pool.close_all()
+        self.workdir.cleanup()
+
+    def test_write_to_second_table_invalidates(self):
+        @with_db_connection(pool=self.pool)
+        @_cache_query.cache_query(maxsize=8)
+        def fetch(conn, query, params=()):
+            return conn.execute(query, params).fetchall()
+
+        @with_db_connection(pool=self.pool)
+        @_transactional.transactional
+        def retitle(conn, title):
+            conn.execute("UPDATE posts SET title = ? WHERE id = 1", (title,))
+
+        query = "SELECT p.title FROM users u, posts p WHERE u.id = p.uid"
+        self.assertEqual(fetch(query), [("t1",)])
+        retitle("CHANGED")
+        self.assertEqual(fetch(query), [("CHANGED",)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from db_pool import AsyncConnectionPool, ConnectionPool, with_db_connection
+from sqlite_utils import QueryTimeout, statement_timeout
+
+try:
+    import aiosqlite
+except ImportError:
+    aiosqlite = None
+
+# Runs for seconds unless interrupted; bounded so a broken timeout fails
+# the test instead of hanging it
+SLOW_QUERY = """
+    WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c LIMIT 50000000)
+    SELECT COUNT(*) FROM c
+"""
+
+
+class StatementTimeoutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+
+    def tearDown(self):
+        self.conn.close()
+
+    def run_slow(self, timeout):
+        start = time.monotonic()
+        with self.assertRaises(QueryTimeout):
+            with statement_timeout(self.conn, timeout):
+                self.conn.execute(SLOW_QUERY).fetchone()
+        return time.monotonic() - start
+
+    def test_slow_statement_is_interrupted(self):
+        self.assertLess(self.run_slow(0.05), 1.0)
+        # The connection stays usable and the handler is gone
+        self.assertEqual(self.conn.execute(
+            "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c"
+            " LIMIT 100000) SELECT COUNT(*) FROM c").fetchone(), (100000,))
+
+    def test_nested_scope_never_extends_the_outer_deadline(self):
+        start = time.monotonic()
+        with self.assertRaises(QueryTimeout):
+            with statement_timeout(self.conn, 0.05):
+                with statement_timeout(self.conn, 30):
+                    self.conn.execute(SLOW_QUERY).fetchone()
+        self.assertLess(time.monotonic() - start, 1.0)
+
+    def test_inner_scope_can_be_shorter(self):
+        with statement_timeout(self.conn, 30):
+            self.assertLess(self.run_slow(0.05), 1.0)
+            self.assertEqual(self.conn.execute("SELECT 1").fetchone(), (1,))
+
+    def test_other_errors_pass_through(self):
+        with self.assertRaises(sqlite3.OperationalError) as caught:
+            with statement_timeout(self.conn, 5):
+                self.conn.execute("SELECT * FROM missing")
+        self.assertNotIsInstance(caught.exception, QueryTimeout)
+
+
+class DecoratorTimeoutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.workdir.name, "users.db")
+        sqlite3.connect(self.path).close()
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def test_with_db_connection_query_timeout(self):
+        pool = ConnectionPool(self.path)
+
+        @with_db_connection(pool=pool, query_timeout=0.05)
+        def slow(conn):
+            return conn.execute(SLOW_QUERY).fetchone()
+
+        try:
+            with self.assertRaises(QueryTimeout):
+                slow()
+        finally:
+            pool.close_all()
+
+    @unittest.skipIf(aiosqlite is None, "aiosqlite is not installed")
+    def test_async_query_timeout(self):
+        pool = AsyncConnectionPool(self.path)
+
+        @with_db_connection(pool=pool, query_timeout=0.05)
+        async def slow(conn):
+            async with conn.execute(SLOW_QUERY) as cursor:
+                return await cursor.fetchone()
+
+        async def main():
+            try:
+                await slow()
+            finally:
+                await pool.close_all()
+
+        with self.assertRaises(QueryTimeout):
+            asyncio.run(main())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+import io
+import os
+import sqlite3
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+from db_pool import ConnectionPool, with_db_connection
+
+_transactional = __import__("2-transactional")
+transactional = _transactional.transactional
+GroupCommitter = _transactional.GroupCommitter
+
+
+class DatabaseTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.workdir.name, "users.db")
+        conn = sqlite3.connect(self.path)
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, email TEXT)")
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def emails(self):
+        conn = sqlite3.connect(self.path)
+        try:
+            return [row[0] for row in conn.execute(
+                "SELECT email FROM users ORDER BY id")]
+        finally:
+            conn.close()
+
+
+class SavepointTest(DatabaseTestCase):
+
+    def test_failed_inner_call_rolls_back_only_its_work(self):
+        pool = ConnectionPool(self.path)
+
+        @transactional
+        def inner(conn):
+            conn.execute("INSERT INTO users VALUES (2, 'inner')")
+            raise ValueError("inner failed")
+
+        @with_db_connection(pool=pool)
+        @transactional
+        def outer(conn):
+            conn.execute("INSERT INTO users VALUES (1, 'outer')")
+            with self.assertRaises(ValueError):
+                inner(conn)
+            conn.execute("INSERT INTO users VALUES (3, 'after')")
+
+        outer()
+        pool.close_all()
+        self.assertEqual(self.emails(), ["outer", "after"])
+
+    def test_outer_failure_rolls_back_released_savepoints(self):
+        pool = ConnectionPool(self.path)
+
+        @transactional
+        def inner(conn):
+            conn.execute("INSERT INTO users VALUES (2, 'inner')")
+
+        @with_db_connection(pool=pool)
+        @transactional
+        def outer(conn):
+            conn.execute("INSERT INTO users VALUES (1, 'outer')")
+            inner(conn)
+            raise ValueError("outer failed")
+
+        with self.assertRaises(ValueError):
+            outer()
+        pool.close_all()
+        self.assertEqual(self.emails(), [])
+
+
+class GroupCommitterTest(DatabaseTestCase):
+
+    def test_failing_call_does_not_affect_its_batch(self):
+        # A wide window so all three calls land in the same batch
+        committer = GroupCommitter(self.path, window=0.2)
+
+        def insert(conn, user_id, email):
+            conn.execute("INSERT INTO users VALUES (?, ?)", (user_id, email))
+            return user_id
+
+        def broken(conn):
+            conn.execute("INSERT INTO users VALUES (2, 'broken')")
+            raise ValueError("broken")
+
+        futures = [
+            committer.submit(insert, 1, "a"),
+            committer.submit(broken),
+            committer.submit(insert, 3, "c"),
+        ]
+        try:
+            self.assertEqual(futures[0].result(5), 1)
+            with self.assertRaises(ValueError):
+                futures[1].result(5)
+            self.assertEqual(futures[2].result(5), 3)
+        finally:
+            committer.stop()
+        self.assertEqual(self.emails(), ["a", "c"])
+        self.assertEqual((committer.committed, committer.failed), (2, 1))
+
+    def test_unopenable_database_fails_every_submit(self):
+        committer = GroupCommitter(
+            os.path.join(self.workdir.name, "missing", "x.db"))
+        with redirect_stdout(io.StringIO()):
+            for _ in range(2):
+                future = committer.submit(lambda conn: None)
+                with self.assertRaises(sqlite3.OperationalError):
+                    future.result(5)
+        self.assertIsNone(committer._thread)
+
+    def test_base_exception_fails_batch_and_writer_restarts(self):
+        committer = GroupCommitter(self.path, window=0.2)
+
+        class Abort(BaseException):
+            pass
+
+        def insert(conn, user_id):
+            conn.execute("INSERT INTO users VALUES (?, 'x')", (user_id,))
+            return user_id
+
+        def abort(conn):
+            raise Abort()
+
+        with redirect_stdout(io.StringIO()):
+            futures = [committer.submit(insert, 1), committer.submit(abort),
+                       committer.submit(insert, 2)]
+            for future in futures:
+                with self.assertRaises(Abort):
+                    future.result(5)
+            try:
+                self.assertEqual(committer.submit(insert, 3).result(5), 3)
+            finally:
+                committer.stop()
+        self.assertEqual(self.emails(), ["x"])
+
+
+if __name__ == "__main__":
+    unittest.main()
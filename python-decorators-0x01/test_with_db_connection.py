@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+import asyncio
+import gc
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from db_pool import AsyncConnectionPool, default_pool
+
+try:
+    import aiosqlite
+except ImportError:
+    aiosqlite = None
+
+_with_db_connection = __import__("1-with_db_connection")
+UserLoader = _with_db_connection.UserLoader
+AsyncUserLoader = _with_db_connection.AsyncUserLoader
+
+
+class LoaderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.workdir.name, "users.db")
+        conn = sqlite3.connect(self.path)
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT)")
+        conn.executemany("INSERT INTO users VALUES (?, ?)",
+                         [(i, f"user{i}") for i in range(1, 6)])
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+
+class UserLoaderTest(LoaderTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # get_users_by_ids draws from default_pool, which opens users.db
+        self.cwd = os.getcwd()
+        os.chdir(self.workdir.name)
+
+    def tearDown(self):
+        default_pool.close_all()
+        os.chdir(self.cwd)
+        super().tearDown()
+
+    def test_handles_share_one_query_and_misses_are_memoised(self):
+        loader = UserLoader()
+        handles = [loader.load(user_id) for user_id in (1, 3, 99)]
+        self.assertEqual([handle.get() for handle in handles],
+                         [(1, "user1"), (3, "user3"), None])
+        self.assertIsNone(loader.load(99).get())
+        self.assertEqual(loader.queries, 1)
+
+
+@unittest.skipIf(aiosqlite is None, "aiosqlite is not installed")
+class AsyncUserLoaderTest(LoaderTestCase):
+
+    def test_loads_in_one_tick_share_one_pooled_query(self):
+        pool = AsyncConnectionPool(self.path)
+        loader = AsyncUserLoader(pool)
+
+        async def main():
+            rows = await loader.load_many([2, 4, 42])
+            self.assertEqual(await loader.load(4), (4, "user4"))
+            await pool.close_all()
+            return rows
+
+        self.assertEqual(asyncio.run(main()), [(2, "user2"), (4, "user4"), None])
+        self.assertEqual((loader.queries, pool.opened), (1, 1))
+
+    def test_dispatch_task_is_referenced_until_done(self):
+        pool = AsyncConnectionPool(self.path)
+        loader = AsyncUserLoader(pool)
+
+        async def main():
+            future = loader.load(1)
+            await asyncio.sleep(0)
+            self.assertEqual(len(loader._tasks), 1)
+            gc.collect()
+            row = await future
+            await asyncio.sleep(0)
+            self.assertEqual(loader._tasks, set())
+            await pool.close_all()
+            return row
+
+        self.assertEqual(asyncio.run(main()), (1, "user1"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,203 @@
+#!/usr/bin/python3
+"""
+Async-generator versions of stream_users, stream_users_in_batches and
+lazy_pagination, so rows can be streamed with `async for` without
+blocking the event loop.
+
+aiomysql is used when it is installed; otherwise mysql-connector is
+driven from worker threads through a small adapter.
+"""
+
+import asyncio
+
+try:
+    import aiomysql
+except ImportError:
+    aiomysql = None
+
+try:
+    import mysql.connector
+except ImportError:
+    mysql = None
+
+
+DB_CONFIG = {
+    "host": "localhost",
+    "user": "root",
+    "password": "",
+    "database": "ALX_prodev",
+}
+
+# Rows pulled from the server per round trip while streaming
+FETCH_SIZE = 100
+
+
+def _db_errors():
+    """Return the exception types raised by whichever driver is in use."""
+    errors = []
+    if aiomysql is not None:
+        errors.append(aiomysql.Error)
+    if mysql is not None:
+        errors.append(mysql.connector.Error)
+    # Empty without a driver, so "except _db_errors()" catches nothing and
+    # connect_to_prodev()'s missing-driver error propagates
+    return tuple(errors)
+
+
+class _ThreadedConnection:
+    """Runs a blocking mysql-connector connection in worker threads."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.cursor = None
+
+    async def execute(self, query, params=None):
+        self.cursor = await asyncio.to_thread(
+            self.connection.cursor, dictionary=True
+        )
+        await asyncio.to_thread(self.cursor.execute, query, params)
+
+    async def fetchmany(self, size):
+        return await asyncio.to_thread(self.cursor.fetchmany, size)
+
+    async def fetchall(self):
+        return await asyncio.to_thread(self.cursor.fetchall)
+
+    async def close(self):
+        if self.cursor:
+            await asyncio.to_thread(self.cursor.close)
+        await asyncio.to_thread(self.connection.close)
+
+
+class _AioConnection:
+    """Thin wrapper giving aiomysql the same interface as the adapter."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.cursor = None
+
+    async def execute(self, query, params=None):
+        # Server-side cursor: rows stay on the server until fetched
+        self.cursor = await self.connection.cursor(aiomysql.SSDictCursor)
+        await self.cursor.execute(query, params)
+
+    async def fetchmany(self, size):
+        return await self.cursor.fetchmany(size)
+
+    async def fetchall(self):
+        return await self.cursor.fetchall()
+
+    async def close(self):
+        if self.cursor:
+            await self.cursor.close()
+        self.connection.close()
+
+
+async def connect_to_prodev():
+    """Open an async connection to the ALX_prodev database."""
+    if aiomysql is not None:
+        connection = await aiomysql.connect(
+            host=DB_CONFIG["host"],
+            user=DB_CONFIG["user"],
+            password=DB_CONFIG["password"],
+            db=DB_CONFIG["database"],
+        )
+        return _AioConnection(connection)
+    if mysql is None:
+        raise RuntimeError("aiomysql or mysql-connector-python is required")
+    connection = await asyncio.to_thread(mysql.connector.connect, **DB_CONFIG)
+    return _ThreadedConnection(connection)
+
+
+async def stream_users():
+    """
+    Async generator that yields one user record at a time
+    from the user_data table in the ALX_prodev database.
+    """
+    connection = None
+    try:
+        connection = await connect_to_prodev()
+        await connection.execute("SELECT * FROM user_data;")
+
+        while True:
+            rows = await connection.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+
+    except _db_errors() as err:
+        print(f"Database error: {err}")
+    finally:
+        if connection:
+            await connection.close()
+
+
+async def stream_users_in_batches(batch_size):
+    """
+    Async generator that yields users in batches of `batch_size`
+    from the user_data table.
+    """
+    connection = None
+    try:
+        connection = await connect_to_prodev()
+        await connection.execute("SELECT * FROM user_data;")
+
+        while True:
+            batch = await connection.fetchmany(batch_size)
+            if not batch:
+                break
+            yield batch
+
+    except _db_errors() as err:
+        print(f"Database error: {err}")
+    finally:
+        if connection:
+            await connection.close()
+
+
+async def batch_processing(batch_size):
+    """Processes each batch to filter users over age 25."""
+    async for batch in stream_users_in_batches(batch_size):
+        for user in batch:
+            if user["age"] > 25:
+                print(user)
+
+
+async def paginate_users(page_size, offset):
+    """Fetch a page of users from the user_data table."""
+    connection = await connect_to_prodev()
+    try:
+        await connection.execute(
+            "SELECT * FROM user_data LIMIT %s OFFSET %s", (page_size, offset)
+        )
+        return await connection.fetchall()
+    finally:
+        await connection.close()
+
+
+async def lazy_pagination(page_size):
+    """Async generator that lazily loads pages from the user_data table."""
+    offset = 0
+    while True:
+        page = await paginate_users(page_size, offset)
+        if not page:
+            break
+        yield page
+        offset += page_size
+
+
+async def main():
+    """Run several streams concurrently on a single event loop."""
+    async def count_rows():
+        return len([row async for row in stream_users()])
+
+    async def count_pages():
+        return len([page async for page in lazy_pagination(50)])
+
+    rows, pages = await asyncio.gather(count_rows(), count_pages())
+    print(f"Streamed {rows} users and {pages} pages concurrently")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
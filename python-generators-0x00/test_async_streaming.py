@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+import asyncio
+import io
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+async_streaming = __import__("5-async_streaming")
+
+USERS = [{"user_id": i, "name": f"user{i}", "age": 20 + i} for i in range(7)]
+
+
+class _FakeCursor:
+    """Stands in for a mysql-connector dictionary cursor over USERS."""
+
+    def __init__(self):
+        self.rows = []
+        self.fetches = 0
+
+    def execute(self, query, params=None):
+        if params is None:
+            self.rows = list(USERS)
+        else:
+            limit, offset = params
+            self.rows = USERS[offset:offset + limit]
+
+    def fetchmany(self, size):
+        self.fetches += 1
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def close(self):
+        pass
+
+
+class _FakeConnection:
+
+    def __init__(self):
+        self.cursors = []
+        self.closed = False
+
+    def cursor(self, dictionary=False):
+        self.cursors.append(_FakeCursor())
+        return self.cursors[-1]
+
+    def close(self):
+        self.closed = True
+
+
+class AsyncStreamingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connections = []
+
+        async def connect():
+            self.connections.append(_FakeConnection())
+            return async_streaming._ThreadedConnection(self.connections[-1])
+
+        patcher = mock.patch.object(async_streaming, "connect_to_prodev", connect)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def collect(self, agen):
+        async def run():
+            return [item async for item in agen]
+        return asyncio.run(run())
+
+    def test_stream_users_yields_every_row_in_chunks(self):
+        with mock.patch.object(async_streaming, "FETCH_SIZE", 3):
+            rows = self.collect(async_streaming.stream_users())
+        self.assertEqual(rows, USERS)
+        # 3 + 3 + 1 rows, then an empty fetch ends the stream
+        self.assertEqual(self.connections[0].cursors[0].fetches, 4)
+        self.assertTrue(self.connections[0].closed)
+
+    def test_batches_and_pages(self):
+        batches = self.collect(async_streaming.stream_users_in_batches(5))
+        self.assertEqual([len(batch) for batch in batches], [5, 2])
+        pages = self.collect(async_streaming.lazy_pagination(4))
+        self.assertEqual(pages, [USERS[:4], USERS[4:]])
+        self.assertTrue(all(conn.closed for conn in self.connections))
+
+    def test_closing_early_closes_the_connection(self):
+        async def first():
+            stream = async_streaming.stream_users()
+            row = await stream.__anext__()
+            await stream.aclose()
+            return row
+
+        self.assertEqual(asyncio.run(first()), USERS[0])
+        self.assertTrue(self.connections[0].closed)
+
+
+class MissingDriverTest(unittest.TestCase):
+
+    def test_missing_driver_error_propagates(self):
+        async def run():
+            return [row async for row in async_streaming.stream_users()]
+
+        with mock.patch.object(async_streaming, "aiomysql", None), \
+                mock.patch.object(async_streaming, "mysql", None), \
+                redirect_stdout(io.StringIO()):
+            with self.assertRaises(RuntimeError):
+                asyncio.run(run())
+
+
+if __name__ == "__main__":
+    unittest.main()